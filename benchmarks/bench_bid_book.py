@@ -0,0 +1,106 @@
+import sys
+import time
+import random
+from collections import defaultdict
+
+import numpy as np
+
+from dnd_auction_game.bid_book import BidBook
+
+
+############################################################################################
+#
+# bench_bid_book
+#   One round of bids: taking the bids in, settling them (winners + cashback) and building
+#   the sorted bid lists of prev_auctions.
+#     before: defaultdict(list) of (a_id, gold), max() scan + second pass per auction,
+#             then a sort of every auction's list
+#     after:  BidBook (one add_many per agent message), max/ties kept as the bids arrive,
+#             numpy settlement, one lexsort
+#
+#   python benchmarks/bench_bid_book.py [n_agents] [n_auctions] [bids_per_agent]
+#
+############################################################################################
+
+
+def make_bids(n_agents:int, n_auctions:int, bids_per_agent:int) -> list:
+    rng = random.Random(1)
+    auction_ids = ["a{}".format(k) for k in range(n_auctions)]
+    # one message per agent: (slot, [(auction_id, gold), ...])
+    messages = []
+    for slot in range(n_agents):
+        messages.append((slot, [(rng.choice(auction_ids), rng.randint(1, 300)) for _ in range(bids_per_agent)]))
+    return auction_ids, messages
+
+
+def before(auction_ids:list, messages:list, ids:list, rewards:dict) -> float:
+    start = time.perf_counter()
+    current_bids = defaultdict(list)
+    for slot, bids in messages:
+        a_id = ids[slot]
+        for auction_id, gold in bids:
+            current_bids[auction_id].append((a_id, gold))
+    t_in = time.perf_counter()
+
+    slots = {a_id: slot for slot, a_id in enumerate(ids)}
+    win_slots, win_points, lose_slots, lose_bids = [], [], [], []
+    for auction_id, auction_bids in current_bids.items():
+        if not auction_bids:
+            continue
+        win_amount = max(auction_bids, key=lambda x:x[1])[1]
+        reward = rewards[auction_id]
+        for a_id, bid in auction_bids:
+            if bid == win_amount:
+                win_slots.append(slots[a_id])
+                win_points.append(reward)
+            else:
+                lose_slots.append(slots[a_id])
+                lose_bids.append(bid)
+    points = np.zeros(len(ids), dtype=np.int64)
+    np.add.at(points, win_slots, win_points)
+    t_settle = time.perf_counter()
+
+    out = {}
+    for auction_id in auction_ids:
+        current_bids[auction_id].sort(key=lambda x:x[1], reverse=True)
+        out[auction_id] = [{"a_id": a_id, "gold": g} for a_id, g in current_bids[auction_id]]
+    t_out = time.perf_counter()
+    return t_in - start, t_settle - t_in, t_out - t_settle
+
+
+def after(auction_ids:list, messages:list, ids:list, rewards:dict) -> float:
+    start = time.perf_counter()
+    book = BidBook(auction_ids)
+    index = book.index
+    for slot, bids in messages:
+        book.add_many(slot, [index[auction_id] for auction_id, _ in bids], [gold for _, gold in bids])
+    t_in = time.perf_counter()
+
+    win_slots, win_points, lose_slots, lose_bids = book.settle(rewards)
+    points = np.zeros(len(ids), dtype=np.int64)
+    np.add.at(points, win_slots, win_points)
+    t_settle = time.perf_counter()
+
+    dict(zip(book.auction_ids, book.results(ids)))
+    t_out = time.perf_counter()
+    return t_in - start, t_settle - t_in, t_out - t_settle
+
+
+def best_of(fn, repeat:int, *args) -> tuple:
+    return min((fn(*args) for _ in range(repeat)), key=sum)
+
+
+if __name__ == "__main__":
+    n_agents = int(sys.argv[1]) if len(sys.argv) >= 2 else 10000
+    n_auctions = int(sys.argv[2]) if len(sys.argv) >= 3 else 15000
+    bids_per_agent = int(sys.argv[3]) if len(sys.argv) >= 4 else 5
+
+    auction_ids, messages = make_bids(n_agents, n_auctions, bids_per_agent)
+    ids = ["agent_{}".format(k) for k in range(n_agents)]
+    rewards = {auction_id: random.randint(1, 60) for auction_id in auction_ids}
+
+    print("agents: {}  auctions: {}  bids: {}".format(n_agents, n_auctions, n_agents * bids_per_agent))
+    print("{:<10} {:>12} {:>12} {:>14} {:>12}".format("", "bids in ms", "settle ms", "results ms", "total ms"))
+    for name, fn in (("before", before), ("after", after)):
+        t = best_of(fn, 5, auction_ids, messages, ids, rewards)
+        print("{:<10} {:>12.2f} {:>12.2f} {:>14.2f} {:>12.2f}".format(name, t[0]*1000.0, t[1]*1000.0, t[2]*1000.0, sum(t)*1000.0))
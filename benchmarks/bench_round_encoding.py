@@ -0,0 +1,67 @@
+import sys
+import json
+import time
+import random
+
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.wire import encode_json, orjson
+
+
+############################################################################################
+#
+# bench_round_encoding
+#   Cost of encoding one round broadcast:
+#     before: send_json per socket => the round is json encoded once per agent
+#     after:  encoded once (orjson when installed) and the same text sent to every socket
+#
+#   python benchmarks/bench_round_encoding.py [n_agents] [n_rounds]
+#
+############################################################################################
+
+
+def make_round(n_agents:int, n_rounds:int) -> dict:
+    house = AuctionHouse(game_token="bench", play_token="bench", seed=1, vectorized=True)
+    house.set_num_rounds(n_rounds)
+    for k in range(n_agents):
+        house.add_agent("agent_{}".format(k), "bench_agent_{}".format(k), "bench")
+
+    # a round in the middle of the game, with a bid from every agent in the previous round
+    round_data = None
+    for _ in range(n_rounds // 2):
+        house.process_all_bids()
+        round_data = house.prepare_auction()
+        auction_ids = list(round_data["auctions"].keys())
+        for a_id in house.store.ids:
+            house.register_bid(a_id, random.choice(auction_ids), random.randint(1, 200))
+
+    return round_data
+
+
+def timeit(fn, repeat:int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    n_agents = int(sys.argv[1]) if len(sys.argv) >= 2 else 500
+    n_rounds = int(sys.argv[2]) if len(sys.argv) >= 3 else 1000
+
+    random.seed(1)
+    round_data = make_round(n_agents, n_rounds)
+    payload = encode_json(round_data)
+
+    repeat = 5
+    per_socket = timeit(lambda: [json.dumps(round_data) for _ in range(n_agents)], repeat)
+    once_json = timeit(lambda: json.dumps(round_data), repeat*20)
+
+    print("agents: {}  payload: {:.1f} kB".format(n_agents, len(payload) / 1024.0))
+    print("{:<40} {:>10.2f} ms/round".format("before: json.dumps once per socket", per_socket*1000.0))
+    print("{:<40} {:>10.2f} ms/round".format("after: json.dumps once", once_json*1000.0))
+
+    if orjson is not None:
+        once_orjson = timeit(lambda: encode_json(round_data), repeat*20)
+        print("{:<40} {:>10.2f} ms/round".format("after: orjson once", once_orjson*1000.0))
+    else:
+        print("orjson is not installed")
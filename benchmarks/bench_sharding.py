@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+import multiprocessing
+
+import websockets
+
+
+############################################################################################
+#
+# bench_sharding
+#   Loopback throughput of the router (dnd_auction_game/router.py) with a different number
+#   of worker processes. Every run starts a router on a free port and plays the same load:
+#   n_games games with n_agents agents each, all rounds advance as soon as every agent has
+#   bid, so the time is the server's time (plus the loopback). The agents run in separate
+#   client processes, so they do not compete with the router for one core.
+#
+#   python benchmarks/bench_sharding.py --workers 1 2 4 --games 16 --agents 200 --rounds 50
+#
+#   The gain needs free cores: on a box with fewer cores than workers + client processes
+#   the runs mostly measure the os scheduler.
+#
+############################################################################################
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def bench_agent(port:int, game_id:str, k:int):
+    uri = "ws://127.0.0.1:{}/ws/{}/play123".format(port, game_id)
+    rng = random.Random(k)
+    async with websockets.connect(uri, max_size=None) as ws:
+        await ws.send(json.dumps({"name": "bench_{}".format(k), "a_id": "bench_{}_{}".format(game_id, k), "player_id": "bench"}))
+        try:
+            async for raw in ws:
+                round_data = json.loads(raw)
+                auction_ids = list(round_data["auctions"].keys())
+                await ws.send(json.dumps({rng.choice(auction_ids): rng.randint(0, 20)} if auction_ids else {}))
+        except websockets.ConnectionClosed:
+            pass
+
+
+def run_clients(port:int, game_ids:list, n_agents:int, ready):
+    # one client process: all the agents of some of the games
+    async def main():
+        tasks = [asyncio.create_task(bench_agent(port, game_id, k)) for game_id in game_ids for k in range(n_agents)]
+        await asyncio.sleep(1.0)
+        ready.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+async def start_game(port:int, game_id:str, n_rounds:int):
+    uri = "ws://127.0.0.1:{}/ws_run/{}/play123".format(port, game_id)
+    async with websockets.connect(uri) as ws:
+        await ws.send(json.dumps({"num_rounds": n_rounds, "time_per_round": 5.0, "advance_when_all_bids": True}))
+        await ws.recv()
+
+
+async def wait_done(port:int, game_ids:list, timeout:float):
+    # polls the router until every game is done
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /api/games HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n")
+        raw = await reader.read()
+        writer.close()
+
+        games = json.loads(raw.partition(b"\r\n\r\n")[2])["games"]
+        done = {g["game_id"] for g in games if g["is_done"]}
+        if all(game_id in done for game_id in game_ids):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+def run(n_workers:int, n_games:int, n_agents:int, n_rounds:int, n_client_processes:int) -> float:
+    port = free_port()
+    env = dict(os.environ)
+    env["AH_LOG_DIR"] = env.get("AH_LOG_DIR", "bench_logs")
+    router = subprocess.Popen([sys.executable, "-m", "dnd_auction_game.router", "--workers", str(n_workers), "--port", str(port)],
+                              env=env, stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(600):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+        game_ids = ["bench{}".format(k) for k in range(n_games)]
+        ctx = multiprocessing.get_context("spawn")
+        clients = []
+        for k in range(n_client_processes):
+            ready = ctx.Event()
+            p = ctx.Process(target=run_clients, args=(port, game_ids[k::n_client_processes], n_agents, ready))
+            p.start()
+            clients.append((p, ready))
+        for _, ready in clients:
+            ready.wait()
+
+        async def play():
+            await asyncio.gather(*[start_game(port, game_id, n_rounds) for game_id in game_ids])
+            return await wait_done(port, game_ids, timeout=600)
+
+        start = time.perf_counter()
+        finished = asyncio.run(play())
+        elapsed = time.perf_counter() - start
+        if not finished:
+            print("  not all games finished")
+
+        for p, _ in clients:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+        return elapsed
+
+    finally:
+        router.terminate()
+        router.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loopback throughput of the router with 1..N workers.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--games", type=int, default=16)
+    parser.add_argument("--agents", type=int, default=200, help="agents per game")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--client-processes", type=int, default=2)
+    args = parser.parse_args()
+
+    print("cpus: {}, games: {}, agents per game: {}, rounds: {}".format(os.cpu_count(), args.games, args.agents, args.rounds))
+    print("{:>8} {:>10} {:>12} {:>18} {:>9}".format("workers", "seconds", "rounds/s", "agent-rounds/s", "speedup"))
+    base = None
+    for n_workers in args.workers:
+        elapsed = run(n_workers, args.games, args.agents, args.rounds, args.client_processes)
+        rounds = args.games * args.rounds
+        base = elapsed if base is None else base
+        print("{:>8} {:>10.2f} {:>12.1f} {:>18.0f} {:>8.2f}x".format(n_workers, elapsed, rounds / elapsed,
+                                                                    rounds * args.agents / elapsed, base / elapsed))
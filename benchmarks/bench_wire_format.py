@@ -0,0 +1,50 @@
+import sys
+import json
+import random
+
+from dnd_auction_game.wire import FORMAT_JSON, FORMAT_MSGPACK, encode, decode, msgpack, orjson
+
+from bench_round_encoding import make_round, timeit
+
+
+############################################################################################
+#
+# bench_wire_format
+#   Round trip (encode + decode) of a round message and of a bid message, for the
+#   json and msgpack wire formats.
+#
+#   python benchmarks/bench_wire_format.py [n_agents] [n_rounds]
+#
+############################################################################################
+
+
+if __name__ == "__main__":
+    n_agents = int(sys.argv[1]) if len(sys.argv) >= 2 else 500
+    n_rounds = int(sys.argv[2]) if len(sys.argv) >= 3 else 1000
+
+    random.seed(1)
+    round_data = make_round(n_agents, n_rounds)
+    bids = {auction_id: random.randint(1, 100) for auction_id in round_data["auctions"]}
+
+    formats = [("json (stdlib)", None), (FORMAT_JSON + (" (orjson)" if orjson is not None else ""), FORMAT_JSON)]
+    if msgpack is not None:
+        formats.append((FORMAT_MSGPACK, FORMAT_MSGPACK))
+    else:
+        print("msgpack is not installed")
+
+    print("agents: {}".format(n_agents))
+    print("{:<20} {:>12} {:>16} {:>12} {:>16}".format("format", "round kB", "round ms", "bids kB", "bids us"))
+    for name, wire_format in formats:
+        if wire_format is None:
+            enc = json.dumps
+            dec = json.loads
+        else:
+            enc = lambda m, f=wire_format: encode(m, f)
+            dec = lambda d, f=wire_format: decode(d, f)
+
+        round_size = len(enc(round_data))
+        bids_size = len(enc(bids))
+        round_time = timeit(lambda: dec(enc(round_data)), 50)
+        bids_time = timeit(lambda: dec(enc(bids)), 2000)
+
+        print("{:<20} {:>12.1f} {:>16.3f} {:>12.2f} {:>16.2f}".format(name, round_size / 1024.0, round_time*1000.0, bids_size / 1024.0, bids_time*1e6))
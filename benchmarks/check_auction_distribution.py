@@ -0,0 +1,96 @@
+import sys
+import math
+from collections import Counter
+
+from dnd_auction_game.auction_house import AuctionHouse
+
+
+############################################################################################
+#
+# check_auction_distribution
+#   _generate_auctions_vectorized must draw the auctions from the same distribution as
+#   _generate_auctions. Both are run with fixed seeds and compared with a two-sample
+#   chi-square test on the (die, num, bonus) of the auctions and on the rolled reward.
+#   Fails (exit code 1) when a p-value is below ALPHA.
+#
+#   python benchmarks/check_auction_distribution.py [n_rounds] [n_agents]
+#
+############################################################################################
+
+
+ALPHA = 0.001
+MIN_EXPECTED = 10 # bins with fewer counts (both samples together) are merged into one
+
+
+def chi2_sf(x:float, dof:int) -> float:
+    # p-value of a chi-square statistic, Wilson-Hilferty approximation (no scipy needed, good for dof >= 10)
+    if dof <= 0:
+        return 1.0
+    z = ((x / dof) ** (1.0 / 3.0) - (1.0 - 2.0 / (9.0 * dof))) / math.sqrt(2.0 / (9.0 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2.0))
+
+
+def two_sample_chi2(a:Counter, b:Counter) -> tuple:
+    # (statistic, dof, p-value) for two samples of the same size
+    n_a, n_b = sum(a.values()), sum(b.values())
+    ka, kb = math.sqrt(n_b / n_a), math.sqrt(n_a / n_b)
+
+    bins = []
+    rest_a, rest_b = 0, 0
+    for key in set(a) | set(b):
+        if a[key] + b[key] < MIN_EXPECTED:
+            rest_a += a[key]
+            rest_b += b[key]
+        else:
+            bins.append((a[key], b[key]))
+    if rest_a + rest_b > 0:
+        bins.append((rest_a, rest_b))
+
+    stat = sum((ka * x - kb * y) ** 2 / (x + y) for x, y in bins)
+    dof = len(bins) - 1
+    return stat, dof, chi2_sf(stat, dof)
+
+
+def sample(vectorized:bool, seed:int, n_rounds:int, n_agents:int) -> tuple:
+    house = AuctionHouse(game_token="check", play_token="check", seed=seed, vectorized=vectorized)
+    for k in range(n_agents):
+        house.add_agent("agent_{}".format(k), "check_agent_{}".format(k), "check")
+
+    shapes = Counter()
+    rewards = Counter()
+    for _ in range(n_rounds):
+        if vectorized:
+            auctions, rolls = house._generate_auctions_vectorized()
+        else:
+            auctions, rolls = house._generate_auctions()
+        for auction_id, a in auctions.items():
+            shapes[(a["die"], a["num"], a["bonus"])] += 1
+            rewards[rolls[auction_id]] += 1
+    return shapes, rewards
+
+
+def mean(counts:Counter) -> float:
+    return sum(k * n for k, n in counts.items()) / sum(counts.values())
+
+
+if __name__ == "__main__":
+    n_rounds = int(sys.argv[1]) if len(sys.argv) >= 2 else 100
+    n_agents = int(sys.argv[2]) if len(sys.argv) >= 3 else 1000
+
+    shapes_loop, rewards_loop = sample(False, 1, n_rounds, n_agents)
+    shapes_vec, rewards_vec = sample(True, 2, n_rounds, n_agents)
+
+    print("auctions: {} per sample".format(sum(shapes_loop.values())))
+    print("mean reward: loop {:.3f}  vectorized {:.3f}".format(mean(rewards_loop), mean(rewards_vec)))
+
+    failed = []
+    for name, a, b in (("(die, num, bonus)", shapes_loop, shapes_vec), ("reward", rewards_loop, rewards_vec)):
+        stat, dof, p = two_sample_chi2(a, b)
+        ok = p >= ALPHA
+        if not ok:
+            failed.append(name)
+        print("{:<18} chi2 {:>9.1f}  dof {:>4}  p {:.4f}  {}".format(name, stat, dof, p, "ok" if ok else "DIFFERENT"))
+
+    if failed:
+        print("the vectorized auctions do not match _generate_auctions (p < {}): {}".format(ALPHA, ", ".join(failed)))
+        sys.exit(1)
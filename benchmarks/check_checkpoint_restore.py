@@ -0,0 +1,81 @@
+import sys
+import random
+import tempfile
+
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.checkpoint import Checkpointer
+
+
+############################################################################################
+#
+# check_checkpoint_restore
+#   A house restored from its checkpoint (snapshot + replayed journal) must be the live
+#   house: same bank schedule, same auctions, same rng state. The game is played across a
+#   reset (a second game after the first), with the snapshot taken before it, so the
+#   replay goes through reset() and set_num_rounds() as well.
+#   Exits with code 1 when something differs.
+#
+#   python benchmarks/check_checkpoint_restore.py [n_agents] [n_rounds]
+#
+############################################################################################
+
+
+def play(house:AuctionHouse, checkpointer:Checkpointer, n_rounds:int, rng:random.Random):
+    house.start()
+    for _ in range(n_rounds):
+        house.process_all_bids()
+        round_data = house.prepare_auction()
+        auction_ids = list(round_data["auctions"].keys())
+        for a_id in house.store.ids:
+            house.register_bids(a_id, [(auction_id, rng.randint(1, 50)) for auction_id in rng.sample(auction_ids, 2)])
+        checkpointer.record()
+
+
+def compare(live:AuctionHouse, restored:AuctionHouse) -> list:
+    failed = []
+    checks = {
+        "schedule": lambda h: (h.num_rounds_in_game, h.gold_income_per_round, h.bank_limit_per_round, h.bank_interest_per_round),
+        "auctions": lambda h: (h.current_auctions, h.current_rolls, h.auction_counter),
+        "round": lambda h: (h.round_counter, h.game_counter, h.is_active, h.is_done),
+        "agents": lambda h: (list(h.store.ids), h.store.gold.tolist(), h.store.points.tolist()),
+        "rng": lambda h: h.rng.getstate(),
+    }
+    for name, get in checks.items():
+        same = get(live) == get(restored)
+        print("{:<10} {}".format(name, "same" if same else "DIFFERENT"))
+        if not same:
+            failed.append(name)
+    return failed
+
+
+def add_agents(house:AuctionHouse, n_agents:int):
+    for k in range(n_agents):
+        house.add_agent("agent_{}".format(k), "check_agent_{}".format(k), "check")
+
+
+if __name__ == "__main__":
+    n_agents = int(sys.argv[1]) if len(sys.argv) >= 2 else 20
+    n_rounds = int(sys.argv[2]) if len(sys.argv) >= 3 else 5
+    directory = tempfile.mkdtemp(prefix="dnd_auction_check_")
+    rng = random.Random(3)
+
+    house = AuctionHouse(game_token="check", play_token="check", seed=7)
+    checkpointer = Checkpointer(directory, every=10000) # one snapshot, everything else in the wal
+    checkpointer.attach(house)
+
+    add_agents(house, n_agents)
+    house.set_num_rounds(n_rounds)
+    play(house, checkpointer, n_rounds, rng)
+    house.finish()
+
+    house.reset()
+    add_agents(house, n_agents)
+    house.set_num_rounds(n_rounds + 3)
+    play(house, checkpointer, n_rounds, rng)
+    checkpointer.close()
+
+    restored = Checkpointer(directory).restore()
+    failed = compare(house, restored)
+    if failed:
+        print("the restored house differs from the live house: {}".format(", ".join(failed)))
+        sys.exit(1)
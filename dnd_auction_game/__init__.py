@@ -1,2 +1,3 @@
-
 from dnd_auction_game.client import AuctionGameClient
+from dnd_auction_game.multi_client import MultiAgentClient
+from dnd_auction_game.simulator import Simulator
@@ -0,0 +1,87 @@
+from typing import Dict, List
+
+import numpy as np
+
+
+############################################################################################
+#
+# AgentStore
+#   Gold and points for all agents, kept in int64 numpy arrays.
+#   Every agent gets a stable slot (index into the arrays) when it is added, so the
+#   bank and the settlement of a round can update all agents with a single expression.
+#
+############################################################################################
+
+
+class AgentStore:
+    def __init__(self, capacity:int=64):
+        self.slots : Dict[str, int] = {}
+        self.ids : List[str] = []
+
+        self.gold = np.zeros(capacity, dtype=np.int64)
+        self.points = np.zeros(capacity, dtype=np.int64)
+
+        # gold/points at the last take_changes(), to find the agents that changed since then
+        self._snap_gold = np.zeros(0, dtype=np.int64)
+        self._snap_points = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, a_id:str) -> bool:
+        return a_id in self.slots
+
+    def add(self, a_id:str) -> int:
+        if a_id in self.slots:
+            return self.slots[a_id]
+
+        slot = len(self.ids)
+        if slot >= len(self.gold):
+            self._grow(max(2*len(self.gold), 64))
+
+        self.slots[a_id] = slot
+        self.ids.append(a_id)
+        self.gold[slot] = 0
+        self.points[slot] = 0
+        return slot
+
+    def _grow(self, capacity:int):
+        gold = np.zeros(capacity, dtype=np.int64)
+        points = np.zeros(capacity, dtype=np.int64)
+        gold[:len(self.gold)] = self.gold
+        points[:len(self.points)] = self.points
+        self.gold = gold
+        self.points = points
+
+    def active_gold(self) -> np.ndarray:
+        # a view, writes go straight into the store
+        return self.gold[:len(self.ids)]
+
+    def active_points(self) -> np.ndarray:
+        return self.points[:len(self.ids)]
+
+    def get(self, a_id:str) -> dict:
+        slot = self.slots[a_id]
+        return {"gold": int(self.gold[slot]), "points": int(self.points[slot])}
+
+    def as_dict(self) -> Dict[str, dict]:
+        # the classic {a_id: {"gold": .., "points": ..}} view, with plain python ints.
+        n = len(self.ids)
+        gold = self.gold[:n].tolist()
+        points = self.points[:n].tolist()
+        return {a_id: {"gold": g, "points": p} for a_id, g, p in zip(self.ids, gold, points)}
+
+    def take_changes(self) -> Dict[str, dict]:
+        # the agents that were added or got new gold/points since the last call
+        n = len(self.ids)
+        m = len(self._snap_gold)
+        gold = self.gold[:n]
+        points = self.points[:n]
+
+        changed = np.flatnonzero((gold[:m] != self._snap_gold) | (points[:m] != self._snap_points)).tolist()
+        changed.extend(range(m, n))
+
+        self._snap_gold = gold.copy()
+        self._snap_points = points.copy()
+
+        return {self.ids[slot]: {"gold": int(gold[slot]), "points": int(points[slot])} for slot in changed}
@@ -0,0 +1,110 @@
+from typing import Callable, List, Tuple
+
+from dnd_auction_game.wire import encode_json
+from dnd_auction_game.leadboard import build_standings
+
+
+############################################################################################
+#
+# ApiCache
+#   Pre-serialized json for the /api/* endpoints.
+#   Everything the api shows only changes between rounds (or when an agent joins), so the
+#   ETag is built from the game, round, number of agents, is_active and is_done. A response body is
+#   encoded the first time it is asked for in a version and then reused, clients that send
+#   If-None-Match with the current ETag get a 304 without a body.
+#
+############################################################################################
+
+
+class ApiCache:
+    def __init__(self, max_limit:int=1000):
+        self.max_limit = max_limit
+        self.version = None
+        self.bodies = {}
+
+        # (round, encoded results) for every settled round of the current game
+        self.history : List[Tuple[int, str]] = []
+        self.history_game = None
+
+    def etag(self, auction_house) -> str:
+        return '"{}-{}-{}-{}{}"'.format(auction_house.game_counter,
+                                        auction_house.round_counter,
+                                        len(auction_house.store),
+                                        int(auction_house.is_active),
+                                        int(auction_house.is_done))
+
+    def _cached(self, auction_house, key:tuple, build:Callable[[], str]) -> Tuple[str, str]:
+        etag = self.etag(auction_house)
+        if etag != self.version:
+            self.version = etag
+            self.bodies = {}
+
+        if key not in self.bodies:
+            self.bodies[key] = build()
+        return etag, self.bodies[key]
+
+    def _limit(self, limit:int) -> int:
+        return max(1, min(limit, self.max_limit))
+
+    def standings(self, auction_house, offset:int=0, limit:int=100) -> Tuple[str, str]:
+        offset = max(0, offset)
+        limit = self._limit(limit)
+
+        def build():
+            players = build_standings(auction_house, offset=offset, limit=limit)
+            for k, p in enumerate(players, start=offset+1):
+                p["rank"] = k
+
+            return encode_json({
+                "round": auction_house.round_counter,
+                "is_done": auction_house.is_done,
+                "total": len(auction_house.store),
+                "offset": offset,
+                "limit": limit,
+                "players": players,
+            })
+
+        return self._cached(auction_house, ("standings", offset, limit), build)
+
+    def round_info(self, auction_house) -> Tuple[str, str]:
+        def build():
+            r = auction_house.round_counter
+            return encode_json({
+                "round": r,
+                "num_rounds": auction_house.num_rounds_in_game,
+                "is_active": auction_house.is_active,
+                "is_done": auction_house.is_done,
+                "n_agents": len(auction_house.store),
+                "auctions": auction_house.current_auctions,
+                "reminder_gold_income": auction_house.gold_income_per_round[r:],
+                "reminder_bank_limit": auction_house.bank_limit_per_round[r:],
+                "reminder_bank_interest": auction_house.bank_interest_per_round[r:],
+            })
+
+        return self._cached(auction_house, ("round",), build)
+
+    def add_round(self, auction_house, round_data:dict):
+        # call once per round with the state from prepare_auction: stores the results of the previous round
+        if self.history_game != auction_house.game_counter:
+            self.history_game = auction_house.game_counter
+            self.history = []
+
+        if round_data["round"] > 0:
+            r = round_data["round"] - 1
+            self.history.append((r, encode_json({"round": r, "auctions": round_data["prev_auctions"]})))
+
+    def history_page(self, auction_house, from_round:int=0, limit:int=100) -> Tuple[str, str]:
+        limit = self._limit(limit)
+
+        def build():
+            history = self.history if self.history_game == auction_house.game_counter else []
+            start = 0
+            if history:
+                start = min(max(0, from_round - history[0][0]), len(history)) # the rounds are consecutive
+            page = history[start:start+limit]
+            next_round = page[-1][0] + 1 if page else from_round
+
+            # the rounds are already encoded, so they are only joined here
+            return '{{"from":{},"next":{},"rounds":[{}]}}'.format(from_round, next_round, ",".join(body for _, body in page))
+
+        return self._cached(auction_house, ("history", from_round, limit), build)
@@ -1,14 +1,21 @@
 
 from typing import List, Dict, Union
 import random
-from collections import defaultdict
-import json
 import math
 import os
+import copy
 
+import numpy as np
 
+from dnd_auction_game.agent_store import AgentStore
+from dnd_auction_game.ranking import RankingIndex
+from dnd_auction_game.bid_book import BidBook
+from dnd_auction_game.metrics import NULL_METRICS
+from dnd_auction_game.log_writer import LogWriter, JsonLinesSink
 
-def generate_gold_random_walk(n_steps:int) -> List[float]:
+
+
+def generate_gold_random_walk(n_steps:int, rng:random.Random=random) -> List[float]:
 
     gold_per_round = 1000
     step_size = 100
@@ -16,7 +23,7 @@ def generate_gold_random_walk(n_steps:int) -> List[float]:
 
     gold = [gold_per_round]
     for _ in range(n_steps-1):
-        next_gold = gold[-1] + random.randint(-step_size, step_size)
+        next_gold = gold[-1] + rng.randint(-step_size, step_size)
 
         if next_gold < 0:
             next_gold = 0
@@ -28,7 +35,7 @@ def generate_gold_random_walk(n_steps:int) -> List[float]:
 
     return gold
 
-def braavos_bank_limit_random_walk(n_steps:int) -> List[int]:
+def braavos_bank_limit_random_walk(n_steps:int, rng:random.Random=random) -> List[int]:
 
     upper_limit_start = 2000
     upper_limit_end = 10000
@@ -36,7 +43,7 @@ def braavos_bank_limit_random_walk(n_steps:int) -> List[int]:
 
     upper_limits = [upper_limit_start]
     for _ in range(n_steps-1):
-        next_limit = upper_limits[-1] + random.randint(-step_size, step_size)
+        next_limit = upper_limits[-1] + rng.randint(-step_size, step_size)
 
         if next_limit < 0:
             next_limit = 0
@@ -48,7 +55,7 @@ def braavos_bank_limit_random_walk(n_steps:int) -> List[int]:
 
     return upper_limits
 
-def braavos_bank_interest_rate_random_walk(n_steps:int) -> List[float]:
+def braavos_bank_interest_rate_random_walk(n_steps:int, rng:random.Random=random) -> List[float]:
 
     start_rate = 1.05
     min_rate = 0.9
@@ -57,7 +64,7 @@ def braavos_bank_interest_rate_random_walk(n_steps:int) -> List[float]:
 
     rates = [start_rate]
     for _ in range(n_steps-1):
-        next_rate = rates[-1] + random.uniform(-step_size, step_size)
+        next_rate = rates[-1] + rng.uniform(-step_size, step_size)
 
         if next_rate < min_rate:
             next_rate = min_rate
@@ -75,18 +82,48 @@ def braavos_bank_interest_rate_random_walk(n_steps:int) -> List[float]:
 
 
 class AuctionHouse:
-    def __init__(self, game_token:str, play_token:str, save_logs=False):
+    metrics = NULL_METRICS # timings of the round phases, the server sets its Metrics (see metrics.py)
+
+    def __init__(self, game_token:str, play_token:str, save_logs=False, seed:int=None, vectorized:bool=False, log_format:str="jsonln", log_dir:str="."):
         self.is_done = False
         self.is_active = False
+
+        # round clock settings of the current game (set by start, used by the server)
+        self.time_per_round = 1.0
+        self.advance_when_all_bids = False
+
+        # when a list: every call that changes the house is recorded as (method name, args...),
+        # so a snapshot + the journal since then can restore the house exactly (see checkpoint.py)
+        self.journal : List[tuple] = None
         
         self.log_player_id_file = None
         self.log_file = None
+        self.log_columnar_dir = None
+        self.log_writer : LogWriter = None
+        self.columnar_writer : LogWriter = None
+        self.player_id_writer : LogWriter = None
+
+        # jsonln: one json line per round, columnar: see game_log.py, both: write both
+        if log_format not in ("jsonln", "columnar", "both"):
+            raise ValueError("Unknown log format: '{}'".format(log_format))
+        self.log_format = log_format
+        self.log_dir = log_dir
         self.game_token = game_token
         self.play_token = play_token
         self.save_logs = save_logs
         self.gold_income = 1000
+
+        # every house has its own random stream, so games can be seeded and run side by side.
+        self.rng = random.Random(seed)
+
+        # vectorized: draw all the auctions (and dice) of a round in a few numpy calls, seeded from self.rng.
+        self.vectorized = vectorized
+        self.np_rng = None
+        if self.vectorized:
+            self.np_rng = np.random.default_rng(self.rng.getrandbits(64))
         
-        self.agents = {}
+        self.store = AgentStore()
+        self.ranking = RankingIndex() # agents by points, updated as the points change
         self.names = {}
         
         self.auctions_per_agent = 1.5
@@ -98,77 +135,196 @@ class AuctionHouse:
         self.max_bonus = [10,  2, 16,  8,  21,  2,   5,    7,   3] 
         self.min_bonus = [-2, -8, -5, -5, -10, -4,  -5,  -4,  -4]
 
+        self.game_counter = 0 # +1 for every reset, tells games apart when the round counter starts over
         self.round_counter = 0
         self.auction_counter = 1
         self.current_auctions = {}
         self.current_rolls = {} 
-        self.current_bids = defaultdict(list)
+        self.bid_book = BidBook() # the bids of the current auctions
+        self.submitted = set() # agents that has sent bids this round
+        self.changed_states = {} # agents whose gold/points changed since the last round was sent
         
         self.num_rounds_in_game : int = None
         self.gold_income_per_round : List[int] = None
         self.bank_limit_per_round : List[int] = None
         self.bank_interest_per_round : List[float] = None
-        self.set_num_rounds(10)
+        self._set_num_rounds(10)
         
         # set the logfile
-        self._find_log_file()
-
-        print("logging to: '{}'".format(self.log_file))
+        if self.save_logs:
+            self._find_log_file()
+            self._open_logs()
+            print("logging to: '{}'".format(self.log_file))
 
     
     def _find_log_file(self):
         if self.log_file is None:            
             i = 1
 
-            f = "./auction_house_log_{}.jsonln".format(i)         
-            f_player_id = "./auction_house_log_player_id_{}.jsonln".format(i)   
-            while os.path.isfile(f):
-                f = "./auction_house_log_{}.jsonln".format(i)
-                f_player_id = "./auction_house_log_player_id_{}.jsonln".format(i)   
+            f = os.path.join(self.log_dir, "auction_house_log_{}.jsonln".format(i))
+            f_player_id = os.path.join(self.log_dir, "auction_house_log_player_id_{}.jsonln".format(i))
+            while os.path.isfile(f) or os.path.isdir(f.replace(".jsonln", ".cols")):
+                f = os.path.join(self.log_dir, "auction_house_log_{}.jsonln".format(i))
+                f_player_id = os.path.join(self.log_dir, "auction_house_log_player_id_{}.jsonln".format(i))
                 i += 1
 
             self.log_file = f
             self.log_player_id_file = f_player_id
+            self.log_columnar_dir = f.replace(".jsonln", ".cols")
+
+    def _open_logs(self):
+        # the files are kept open and written from a background thread, see LogWriter
+        if self.log_writer is None and self.log_format in ("jsonln", "both"):
+            self.log_writer = LogWriter(JsonLinesSink(self.log_file))
+        if self.columnar_writer is None and self.log_format in ("columnar", "both"):
+            from dnd_auction_game.game_log import ColumnarSink # imported here so 'python -m dnd_auction_game.game_log' runs cleanly
+            self.columnar_writer = LogWriter(ColumnarSink(self.log_columnar_dir))
+        if self.player_id_writer is None:
+            self.player_id_writer = LogWriter(JsonLinesSink(self.log_player_id_file))
+
+    def flush_logs(self):
+        for writer in (self.log_writer, self.columnar_writer, self.player_id_writer):
+            if writer is not None:
+                writer.flush()
+
+    def close_logs(self):
+        for writer in (self.log_writer, self.columnar_writer, self.player_id_writer):
+            if writer is not None:
+                writer.close()
+
+        self.log_writer = None
+        self.columnar_writer = None
+        self.player_id_writer = None
+
+    def __getstate__(self):
+        # the log writers (threads) are not pickled, they are opened again on load
+        state = self.__dict__.copy()
+        state["log_writer"] = None
+        state["columnar_writer"] = None
+        state["player_id_writer"] = None
+        state["journal"] = None
+        state.pop("metrics", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.save_logs and self.log_file is not None:
+            self._open_logs()
+
+    def _record(self, *event):
+        if self.journal is not None:
+            self.journal.append(event)
+
+    def snapshot(self) -> dict:
+        # a copy of the full game state that can be pickled later (from another thread),
+        # containers that change during a round are copied, the rest is replaced every round and shared.
+        state = self.__getstate__()
+        state["store"] = copy.deepcopy(self.store)
+        state["ranking"] = copy.deepcopy(self.ranking)
+        state["names"] = dict(self.names)
+        state["bid_book"] = self.bid_book.copy()
+        state["submitted"] = set(self.submitted)
+        state["rng"] = self.rng.getstate()
+        state["np_rng"] = copy.deepcopy(self.np_rng.bit_generator.state) if self.np_rng is not None else None
+        return state
+
+    @classmethod
+    def from_snapshot(cls, state:dict, open_logs:bool=True) -> "AuctionHouse":
+        house = cls.__new__(cls)
+        house.__dict__.update(state)
+
+        house.rng = random.Random()
+        house.rng.setstate(state["rng"])
+        if state["np_rng"] is not None:
+            house.np_rng = np.random.default_rng()
+            house.np_rng.bit_generator.state = state["np_rng"]
+
+        if open_logs and house.save_logs and house.log_file is not None:
+            house._open_logs()
+        return house
+
+    def replay(self, events:List[tuple]):
+        # apply journal events, without recording them again
+        journal = self.journal
+        self.journal = None
+        try:
+            for event in events:
+                getattr(self, event[0])(*event[1:])
+        finally:
+            self.journal = journal
+
+    def start(self, time_per_round:float=1.0, advance_when_all_bids:bool=False):
+        self._record("start", time_per_round, advance_when_all_bids)
+        self.time_per_round = time_per_round
+        self.advance_when_all_bids = advance_when_all_bids
+        self.is_active = True
+
+    def finish(self):
+        self._record("finish")
+        self.is_active = False
+        self.is_done = True
 
     def reset(self):
+        self._record("reset")
+        self.game_counter += 1
         self.is_done = False
-        self.agents = {}
+        self.store = AgentStore()
+        self.ranking = RankingIndex()
         self.names = {}
         self.current_auctions = {}
         self.current_rolls = {} 
-        self.current_bids = defaultdict(list)
+        self.bid_book = BidBook()
+        self.submitted = set()
         self.round_counter = 0
         self.auction_counter = 1
-        self.set_num_rounds(10)
+        self._set_num_rounds(10)
 
     def set_num_rounds(self, num_rounds:int):
+        self._record("set_num_rounds", num_rounds)
+        self._set_num_rounds(num_rounds)
+
+    def _set_num_rounds(self, num_rounds:int):
+        # not journaled: only the outermost call is recorded, or replay would draw the schedule twice
         self.num_rounds_in_game = num_rounds
         
-        self.gold_income_per_round = generate_gold_random_walk(num_rounds)
-        self.bank_limit_per_round = braavos_bank_limit_random_walk(num_rounds)
-        self.bank_interest_per_round = braavos_bank_interest_rate_random_walk(num_rounds)
+        self.gold_income_per_round = generate_gold_random_walk(num_rounds, self.rng)
+        self.bank_limit_per_round = braavos_bank_limit_random_walk(num_rounds, self.rng)
+        self.bank_interest_per_round = braavos_bank_interest_rate_random_walk(num_rounds, self.rng)
         
     
     def add_agent(self, name:str, a_id:str, player_id:str):
-        if a_id in self.agents:
+        if a_id in self.store:
             print("Agent {}  id:{} reconnected".format(name, a_id))
             return
 
-        with open(self.log_player_id_file, 'a') as fp:
-            pid = {"player_id": player_id, "agent_id": a_id, "name": name}
-            fp.write("{}\n".format(json.dumps(pid)))
+        if self.player_id_writer is not None:
+            self.player_id_writer.write({"player_id": player_id, "agent_id": a_id, "name": name})
                     
-        self.agents[a_id] = {"gold": 0, "points": 0}
+        self._record("add_agent", name, a_id, player_id)
+        slot = self.store.add(a_id)
+        self.ranking.add(slot, int(self.store.points[slot]))
         self.names[a_id] = name
+
+    @property
+    def agents(self) -> Dict[str, dict]:
+        # read only snapshot, {a_id: {"gold": .., "points": ..}} - all updates go through self.store
+        return self.store.as_dict()
     
     
     def prepare_auction(self):        
+        self._record("prepare_auction")
+        metrics = self.metrics
         prev_auctions = self.current_auctions
-        prev_bids = self.current_bids
+        prev_book = self.bid_book
         prev_rolls = self.current_rolls
         
-        self.current_bids = defaultdict(list)
-        self.current_auctions, self.current_rolls = self._generate_auctions()        
+        self.submitted = set()
+        with metrics.phase("generate_auctions"):
+            if self.vectorized:
+                self.current_auctions, self.current_rolls = self._generate_auctions_vectorized()
+            else:
+                self.current_auctions, self.current_rolls = self._generate_auctions()
+            self.bid_book = BidBook(self.current_auctions.keys())
 
 
         
@@ -177,44 +333,69 @@ class AuctionHouse:
         interest_rate = self.bank_interest_per_round[self.round_counter]
         gold_income = self.gold_income_per_round[self.round_counter]
 
-        for agent in self.agents.values():
-            # bank of Braavos gives interest on stored gold
-            
-            interest_available_gold = 0
-            if agent["gold"] >= upper_rate:
-                interest_available_gold = upper_rate
-            else:
-                interest_available_gold = agent["gold"]
-            
-            agent["gold"] = int(interest_available_gold * interest_rate)            
-            agent["gold"] += gold_income
+        # bank of Braavos gives interest on stored gold, up to the upper limit
+        with metrics.phase("bank_update"):
+            gold = self.store.active_gold()
+            interest_available_gold = np.minimum(gold, upper_rate)
+            gold[:] = (interest_available_gold * interest_rate).astype(np.int64) + gold_income
 
                 
-        out_prev_state = {}
-        for auction_id, info in prev_auctions.items():
-            out_prev_state[auction_id] = {}
-            out_prev_state[auction_id].update(info)
-            out_prev_state[auction_id]["reward"] = prev_rolls[auction_id]
-            
-            prev_bids[auction_id].sort(key=lambda x:x[1], reverse=True)            
-            out_prev_state[auction_id]["bids"] = [{"a_id": a_id, "gold": g} for a_id, g in prev_bids[auction_id]]
-
-        state = {
-            "round": self.round_counter,
-            "states": self.agents,
-            "auctions": self.current_auctions,
-            "prev_auctions": out_prev_state,
-            "reminder_gold_income": self.gold_income_per_round[self.round_counter+1:], # +1 as we want to report on the next state - not the current state
-            "reminder_bank_limit": self.bank_limit_per_round[self.round_counter+1:],
-            "reminder_bank_interest": self.bank_interest_per_round[self.round_counter+1:],
-        }
-
-        if self.save_logs and self.log_file is not None:
-            with open(self.log_file, "a") as fp:
-                fp.write("{}\n".format(json.dumps(state)))
+        with metrics.phase("prev_state"):
+            out_prev_state = {}
+            for auction_id, bids in zip(prev_book.auction_ids, prev_book.results(self.store.ids)):
+                out_prev_state[auction_id] = {}
+                out_prev_state[auction_id].update(prev_auctions[auction_id])
+                out_prev_state[auction_id]["reward"] = prev_rolls[auction_id]
+                out_prev_state[auction_id]["bids"] = bids
+
+            self.changed_states = self.store.take_changes()
+
+            state = {
+                "round": self.round_counter,
+                "states": self.store.as_dict(),
+                "auctions": self.current_auctions,
+                "prev_auctions": out_prev_state,
+                "reminder_gold_income": self.gold_income_per_round[self.round_counter+1:], # +1 as we want to report on the next state - not the current state
+                "reminder_bank_limit": self.bank_limit_per_round[self.round_counter+1:],
+                "reminder_bank_interest": self.bank_interest_per_round[self.round_counter+1:],
+            }
+
+        with metrics.phase("log_write"):
+            if self.log_writer is not None:
+                self.log_writer.write(state)
+            if self.columnar_writer is not None:
+                self.columnar_writer.write(state)
         
         self.round_counter += 1
         return state
+
+    def delta_messages(self, state:dict):
+        # protocol 2: the schedule is sent once (in the full message), after that only the agents that
+        # changed are sent. The client rebuilds the protocol 1 view (see AuctionGameClient).
+        full = {
+            "protocol": 2,
+            "type": "full",
+            "round": state["round"],
+            "states": state["states"],
+            "auctions": state["auctions"],
+            "prev_auctions": state["prev_auctions"],
+            "schedule": {
+                "gold_income": self.gold_income_per_round,
+                "bank_limit": self.bank_limit_per_round,
+                "bank_interest": self.bank_interest_per_round,
+            },
+        }
+
+        delta = {
+            "protocol": 2,
+            "type": "delta",
+            "round": state["round"],
+            "states": self.changed_states,
+            "auctions": state["auctions"],
+            "prev_auctions": state["prev_auctions"],
+        }
+
+        return full, delta
         
   
     def _generate_auctions(self) -> Dict[str, dict]:
@@ -223,55 +404,118 @@ class AuctionHouse:
         
         indices = list(range(len(self.die_sizes)))
                 
-        n_auctions = int(math.ceil(self.auctions_per_agent*len(self.agents)))
+        n_auctions = int(math.ceil(self.auctions_per_agent*len(self.store)))
                 
         for _ in range(n_auctions):
-            i = random.choices(indices, weights=self.die_prob, k=1)[0]            
+            i = self.rng.choices(indices, weights=self.die_prob, k=1)[0]            
             die = self.die_sizes[i]
-            n_dices = random.randint(1, self.max_n_die[i])
-            bonus = random.randint(self.min_bonus[i], self.max_bonus[i])
+            n_dices = self.rng.randint(1, self.max_n_die[i])
+            bonus = self.rng.randint(self.min_bonus[i], self.max_bonus[i])
                                     
             auction_id = "a{}".format(self.auction_counter)
             a = {"die": die, "num": n_dices, "bonus": bonus}
             auctions[auction_id] = a
             self.auction_counter += 1
             
-            points = sum( (random.randint(1, a["die"]) for _ in range(a["num"])) )
+            points = sum( (self.rng.randint(1, a["die"]) for _ in range(a["num"])) )
             points += a["bonus"]
             rolls[auction_id] = points
                     
         return auctions, rolls
+
+    def _generate_auctions_vectorized(self) -> Dict[str, dict]:
+        # same distribution as _generate_auctions, but drawn for the whole round at once.
+        n_auctions = int(math.ceil(self.auctions_per_agent*len(self.store)))
+        if n_auctions < 1:
+            return {}, {}
+
+        die_sizes = np.asarray(self.die_sizes, dtype=np.int64)
+        die_prob = np.asarray(self.die_prob, dtype=np.float64)
+        max_n_die = np.asarray(self.max_n_die, dtype=np.int64)
+        min_bonus = np.asarray(self.min_bonus, dtype=np.int64)
+        max_bonus = np.asarray(self.max_bonus, dtype=np.int64)
+
+        idx = self.np_rng.choice(len(die_sizes), size=n_auctions, p=die_prob / die_prob.sum())
+        dies = die_sizes[idx]
+        n_dices = self.np_rng.integers(1, max_n_die[idx], endpoint=True)
+        bonuses = self.np_rng.integers(min_bonus[idx], max_bonus[idx], endpoint=True)
+
+        # roll a (n_auctions x most dice) matrix and mask out the dice each auction does not have
+        max_dices = int(n_dices.max())
+        throws = self.np_rng.integers(1, dies[:, None], size=(n_auctions, max_dices), endpoint=True)
+        throws[np.arange(max_dices)[None, :] >= n_dices[:, None]] = 0
+        points = throws.sum(axis=1) + bonuses
+
+        auctions = {}
+        rolls = {}
+        for die, n, bonus, p in zip(dies.tolist(), n_dices.tolist(), bonuses.tolist(), points.tolist()):
+            auction_id = "a{}".format(self.auction_counter)
+            auctions[auction_id] = {"die": die, "num": n, "bonus": bonus}
+            rolls[auction_id] = p
+            self.auction_counter += 1
+
+        return auctions, rolls
     
     def register_bid(self, a_id:str, auction_id:str, gold:int):        
-        if auction_id not in self.current_auctions:
+        k = self.bid_book.index.get(auction_id)
+        if k is None:
             return
         
         gold = int(gold)
         if gold < 1:
             return
                 
-        if self.agents[a_id]["gold"] < gold:
+        slot = self.store.slots[a_id]
+        if self.store.gold[slot] < gold:
             return
                 
-        self.current_bids[auction_id].append( (a_id, gold) )
-        self.agents[a_id]["gold"] -= gold
+        self._record("register_bid", a_id, auction_id, gold)
+        self.bid_book.add(k, slot, gold)
+        self.store.gold[slot] -= gold
+
+    def register_bids(self, a_id:str, bids:List[tuple]) -> int:
+        # all the bids of one message, [(auction_id, gold), ...] already checked by bid_intake.read_bids.
+        # same result as register_bid for each bid in order, returns the number of bids placed
+        slot = self.store.slots[a_id]
+        gold_left = int(self.store.gold[slot])
+        book = self.bid_book
+        index = book.index
+
+        placed = []
+        ks = []
+        golds = []
+        for auction_id, gold in bids:
+            k = index.get(auction_id)
+            if gold < 1 or gold > gold_left or k is None:
+                continue
+            gold_left -= gold
+            placed.append( (auction_id, gold) )
+            ks.append(k)
+            golds.append(gold)
+
+        if placed:
+            self._record("register_bids", a_id, placed)
+            book.add_many(slot, ks, golds)
+            self.store.gold[slot] = gold_left
+        return len(placed)
     
     def process_all_bids(self):        
-        
-        for auction_id, bids in self.current_bids.items():
-
-            if not bids or len(bids) == 0:
-                continue
-
-            win_amount = max(bids, key=lambda x:x[1])[1]
-            for a_id, bid in bids:
-                if bid == win_amount:
-                    self.agents[a_id]["points"] += self.current_rolls[auction_id]
-                
-                else:
-                    # cashback
-                    back_value = int(math.floor(bid * self.gold_back_fraction))
-                    self.agents[a_id]["gold"] += back_value
+        self._record("process_all_bids")
+        win_slots, win_points, lose_slots, lose_bids = self.bid_book.settle(self.current_rolls)
+
+        if len(win_slots):
+            # only the winners get new points, so only they can move in the ranking
+            changed = np.unique(win_slots)
+            old_points = self.store.points[changed].tolist()
+            np.add.at(self.store.points, win_slots, win_points)
+            new_points = self.store.points[changed].tolist()
+
+            self.ranking.update_many(changed.tolist(), old_points, new_points, self.store.active_points())
+
+        if len(lose_slots):
+            # cashback
+            back_value = np.floor(lose_bids.astype(np.float64) * self.gold_back_fraction).astype(np.int64)
+            np.add.at(self.store.gold, lose_slots, back_value)
             
 
 
@@ -0,0 +1,314 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from typing import Dict, List
+
+import numpy as np
+import websockets
+
+from dnd_auction_game.play import AuctionGameRunner
+from dnd_auction_game.wire import FORMAT_JSON, FORMATS, format_available, encode, decode
+
+
+############################################################################################
+#
+# bench
+#   Load generator for the server: M synthetic agents play a game and the timings are
+#   written as json, to compare releases.
+#
+#   python -m dnd_auction_game.bench --agents 500 --rounds 50 --spawn-server --out bench.json
+#
+#   The agents are raw websocket clients (no callback, no logs) that bid on a few random
+#   auctions every round and ask for an ack of their bids. Measured:
+#     broadcast latency   server_time in the round message => received by the agent
+#     bid rtt             bid message sent => ack received
+#     messages/s          round messages received and bid messages sent, all agents
+#     server cpu/memory   per round, read from /proc (linux) for --spawn-server or --server-pid
+#   The game is started with AuctionGameRunner, like 'python -m dnd_auction_game.play'.
+#   --client-processes spreads the agents over more processes, so they are not the bottleneck.
+#
+############################################################################################
+
+
+def percentiles(values:List[float]) -> Dict[str, float]:
+    if not values:
+        return {"n": 0}
+    a = np.asarray(values, dtype=np.float64)
+    p50, p90, p99 = np.percentile(a, [50, 90, 99]).tolist()
+    return {"n": len(values), "mean": float(a.mean()), "p50": p50, "p90": p90, "p99": p99, "max": float(a.max())}
+
+
+def package_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version("dnd_auction_game")
+    except Exception:
+        return None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ProcessSampler:
+    # cpu seconds and rss of another process, from /proc - None where that is not available
+    def __init__(self, pid:int):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.last_cpu = self.cpu_seconds()
+
+    def cpu_seconds(self) -> float:
+        try:
+            with open("/proc/{}/stat".format(self.pid)) as fp:
+                fields = fp.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.ticks # utime + stime
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def rss_mb(self) -> float:
+        try:
+            with open("/proc/{}/status".format(self.pid)) as fp:
+                for line in fp:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024.0
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def sample(self) -> Dict[str, float]:
+        cpu = self.cpu_seconds()
+        delta = None
+        if cpu is not None and self.last_cpu is not None:
+            delta = cpu - self.last_cpu
+        self.last_cpu = cpu
+        return {"cpu_s": delta, "rss_mb": self.rss_mb()}
+
+
+class AgentStats:
+    def __init__(self):
+        self.broadcast_latency = [] # seconds
+        self.bid_rtt = []
+        self.received = 0
+        self.sent = 0
+
+    def merge(self, other:dict):
+        self.broadcast_latency += other["broadcast_latency"]
+        self.bid_rtt += other["bid_rtt"]
+        self.received += other["received"]
+        self.sent += other["sent"]
+
+    def as_dict(self) -> dict:
+        return {"broadcast_latency": self.broadcast_latency, "bid_rtt": self.bid_rtt,
+                "received": self.received, "sent": self.sent}
+
+
+async def bench_agent(uri:str, k:int, stats:AgentStats, wire_format:str, protocol:int, bids_per_round:int, on_round=None):
+    rng = random.Random(k)
+    async with websockets.connect(uri, max_size=None) as ws:
+        agent_info = {"name": "bench_{}".format(k), "a_id": "bench_agent_{}".format(k), "player_id": "bench", "ack": True}
+        if protocol != 1:
+            agent_info["protocol"] = protocol
+        if wire_format != FORMAT_JSON:
+            agent_info["format"] = wire_format
+        await ws.send(json.dumps(agent_info))
+
+        sent_at = None
+        try:
+            async for raw in ws:
+                now = time.time()
+                message = decode(raw, wire_format)
+                stats.received += 1
+
+                if message.get("type") == "ack":
+                    if sent_at is not None:
+                        stats.bid_rtt.append(time.perf_counter() - sent_at)
+                        sent_at = None
+                    continue
+
+                latency = now - message["server_time"] if "server_time" in message else None
+                if latency is not None:
+                    stats.broadcast_latency.append(latency)
+                if on_round is not None:
+                    on_round(message["round"], latency)
+
+                auction_ids = list(message["auctions"].keys())
+                bids = {}
+                for auction_id in rng.sample(auction_ids, min(bids_per_round, len(auction_ids))):
+                    bids[auction_id] = rng.randint(1, 30)
+
+                sent_at = time.perf_counter()
+                await ws.send(encode(bids, wire_format))
+                stats.sent += 1
+        except websockets.ConnectionClosed:
+            pass
+
+
+def agent_uri(host:str, port:int, game_id:str, token:str) -> str:
+    if game_id is None:
+        return "ws://{}:{}/ws/{}".format(host, port, token)
+    return "ws://{}:{}/ws/{}/{}".format(host, port, game_id, token)
+
+
+def run_client_process(uri:str, first:int, n_agents:int, wire_format:str, protocol:int, bids_per_round:int, ready, results):
+    stats = AgentStats()
+
+    async def main():
+        tasks = [asyncio.create_task(bench_agent(uri, k, stats, wire_format, protocol, bids_per_round)) for k in range(first, first + n_agents)]
+        await asyncio.sleep(1.0)
+        ready.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(main())
+    results.put(stats.as_dict())
+
+
+async def run_bench(args, server_pid:int=None) -> dict:
+    uri = agent_uri(args.host, args.port, args.game, args.token)
+    sampler = ProcessSampler(server_pid) if server_pid is not None else None
+
+    stats = AgentStats()
+    per_round = []
+
+    def on_round(r:int, latency:float):
+        # the probe agent (agent 0): one entry per round
+        entry = {"round": r, "time": time.time(), "broadcast_latency_ms": latency * 1000.0 if latency is not None else None}
+        if sampler is not None:
+            entry.update(sampler.sample())
+        per_round.append(entry)
+
+    # agents in other processes
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    processes = []
+    n_local = args.agents
+    if args.client_processes > 1:
+        per_process = args.agents // args.client_processes
+        n_local = args.agents - per_process * (args.client_processes - 1)
+        for p in range(1, args.client_processes):
+            ready = ctx.Event()
+            process = ctx.Process(target=run_client_process, args=(uri, n_local + (p-1)*per_process, per_process, args.format,
+                                                                  args.protocol, args.bids_per_round, ready, results))
+            process.start()
+            processes.append((process, ready))
+
+    tasks = [asyncio.create_task(bench_agent(uri, k, stats, args.format, args.protocol, args.bids_per_round, on_round if k == 0 else None))
+             for k in range(n_local)]
+    await asyncio.sleep(1.0)
+    loop = asyncio.get_running_loop()
+    for _, ready in processes:
+        await loop.run_in_executor(None, ready.wait)
+
+    runner = AuctionGameRunner(args.host, args.play_token, n_rounds=args.rounds, time_per_round=args.time_per_round,
+                               port=args.port, advance_when_all_bids=args.advance_when_all_bids, game_id=args.game)
+    start = time.time()
+    if sampler is not None:
+        sampler.sample()
+    await loop.run_in_executor(None, runner.run)
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.time() - start
+
+    for process, _ in processes:
+        stats.merge(await loop.run_in_executor(None, results.get))
+        process.join()
+
+    cpu = [r["cpu_s"] for r in per_round if r.get("cpu_s") is not None]
+    rss = [r["rss_mb"] for r in per_round if r.get("rss_mb") is not None]
+    return {
+        "elapsed_s": elapsed,
+        "rounds_seen": len(per_round),
+        "rounds_per_s": len(per_round) / elapsed if elapsed > 0 else None,
+        "broadcast_latency_ms": percentiles([v * 1000.0 for v in stats.broadcast_latency]),
+        "bid_rtt_ms": percentiles([v * 1000.0 for v in stats.bid_rtt]),
+        "messages_per_s": {"received": stats.received / elapsed, "sent": stats.sent / elapsed},
+        "server": {"cpu_s_per_round": percentiles(cpu), "rss_mb_max": max(rss) if rss else None,
+                   "rss_mb_last": rss[-1] if rss else None} if sampler is not None else None,
+        "per_round": per_round,
+    }
+
+
+def start_server(port:int, log_dir:str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["AH_LOG_DIR"] = log_dir
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "dnd_auction_game.server:app", "--host", "127.0.0.1",
+                               "--port", str(port), "--log-level", "warning"], env=env, stdout=subprocess.DEVNULL)
+    for _ in range(600):
+        if server.poll() is not None:
+            raise RuntimeError("server exited with code {}".format(server.returncode))
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError("server did not start")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the auction server and write the timings as json.")
+    parser.add_argument("--agents", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--time-per-round", type=float, default=1.0)
+    parser.add_argument("--advance-when-all-bids", action="store_true")
+    parser.add_argument("--bids-per-round", type=int, default=3, help="auctions each agent bids on per round")
+    parser.add_argument("--protocol", type=int, default=1, choices=[1, 2])
+    parser.add_argument("--format", default=FORMAT_JSON, choices=list(FORMATS))
+    parser.add_argument("--client-processes", type=int, default=1)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--token", default="play123")
+    parser.add_argument("--play-token", default="play123")
+    parser.add_argument("--game", default=None, help="game id (default: the default game)")
+    parser.add_argument("--spawn-server", action="store_true", help="start a server on a free port (logs in a temp folder)")
+    parser.add_argument("--server-pid", type=int, default=None, help="pid of a running server, to sample its cpu/memory")
+    parser.add_argument("--out", default=None, help="json file for the results (default: print)")
+    args = parser.parse_args()
+
+    if not format_available(args.format):
+        print("format '{}' is not installed".format(args.format))
+        sys.exit(1)
+
+    server = None
+    server_pid = args.server_pid
+    if args.spawn_server:
+        args.host = "127.0.0.1"
+        args.port = free_port()
+        server = start_server(args.port, tempfile.mkdtemp(prefix="dnd_auction_bench_"))
+        server_pid = server.pid
+
+    try:
+        results = asyncio.run(run_bench(args, server_pid=server_pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        "version": package_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "env": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k not in ("out",)},
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.out is not None:
+        with open(args.out, "w") as fp:
+            fp.write(text)
+        r = results
+        print("{} rounds in {:.1f}s  broadcast p50/p99: {:.2f}/{:.2f} ms  bid rtt p50/p99: {:.2f}/{:.2f} ms  => {}".format(
+            r["rounds_seen"], r["elapsed_s"], r["broadcast_latency_ms"].get("p50", 0), r["broadcast_latency_ms"].get("p99", 0),
+            r["bid_rtt_ms"].get("p50", 0), r["bid_rtt_ms"].get("p99", 0), args.out))
+    else:
+        print(text)
@@ -0,0 +1,109 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+############################################################################################
+#
+# BidBook
+#   The bids of one round. Each auction of the round gets an index, the bids are kept in
+#   three parallel lists (auction index, agent slot, gold) in the order they arrived.
+#   The highest bid of every auction and the number of bids at that amount (the tie set)
+#   are updated as the bids come in, so the winners are known without scanning the bids.
+#
+#   settle() hands the arrays to numpy for the winners/cashback, results() gives the bids
+#   of every auction sorted by gold (highest first, ties in arrival order) with one lexsort
+#   for the whole round - the same order as sorting each auction's list on its own.
+#
+############################################################################################
+
+
+class BidBook:
+    def __init__(self, auction_ids:List[str]=()):
+        self.auction_ids : List[str] = list(auction_ids)
+        self.index : Dict[str, int] = {auction_id: k for k, auction_id in enumerate(self.auction_ids)}
+
+        # parallel lists (appending to a list is much cheaper than to an array.array),
+        # turned into int64 numpy arrays once per round in settle() and results()
+        self.auction : List[int] = []
+        self.slot : List[int] = []
+        self.gold : List[int] = []
+
+        self.max_gold : List[int] = [0] * len(self.auction_ids)
+        self.n_max : List[int] = [0] * len(self.auction_ids) # bids at max_gold
+
+    def __len__(self) -> int:
+        return len(self.gold)
+
+    def add(self, k:int, slot:int, gold:int):
+        # k: index of the auction (self.index[auction_id])
+        self.auction.append(k)
+        self.slot.append(slot)
+        self.gold.append(gold)
+
+        top = self.max_gold[k]
+        if gold > top:
+            self.max_gold[k] = gold
+            self.n_max[k] = 1
+        elif gold == top:
+            self.n_max[k] += 1
+
+    def add_many(self, slot:int, ks:List[int], golds:List[int]):
+        # all the bids of one agent: auction indexes and gold
+        self.auction += ks
+        self.slot += [slot] * len(ks)
+        self.gold += golds
+
+        max_gold = self.max_gold
+        n_max = self.n_max
+        for k, gold in zip(ks, golds):
+            top = max_gold[k]
+            if gold > top:
+                max_gold[k] = gold
+                n_max[k] = 1
+            elif gold == top:
+                n_max[k] += 1
+
+    def leader(self, auction_id:str) -> Tuple[int, int]:
+        # (highest bid, number of agents that bid it), (0, 0) without bids
+        k = self.index[auction_id]
+        return self.max_gold[k], self.n_max[k]
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return (np.array(self.auction, dtype=np.int64),
+                np.array(self.slot, dtype=np.int64),
+                np.array(self.gold, dtype=np.int64))
+
+    def settle(self, rewards:Dict[str, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # (winner slots, their points, loser slots, their bids) - every bid at the max of its auction wins
+        auction, slot, gold = self.arrays()
+        won = gold == np.asarray(self.max_gold, dtype=np.int64)[auction]
+
+        reward = np.fromiter((rewards[auction_id] for auction_id in self.auction_ids), dtype=np.int64, count=len(self.auction_ids))
+        lost = ~won
+        return slot[won], reward[auction[won]], slot[lost], gold[lost]
+
+    def results(self, ids:List[str]) -> List[List[dict]]:
+        # per auction (in self.auction_ids order): [{"a_id": .., "gold": ..}, ...] highest bid first
+        # ids: agent id per slot
+        n_auctions = len(self.auction_ids)
+        if len(self.gold) == 0:
+            return [[] for _ in range(n_auctions)]
+
+        auction, slot, gold = self.arrays()
+        order = np.lexsort((-gold, auction)) # lexsort is stable => ties stay in arrival order
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(auction, minlength=n_auctions)))).tolist()
+
+        bids = [{"a_id": ids[s], "gold": g} for s, g in zip(slot[order].tolist(), gold[order].tolist())]
+        return [bids[bounds[k]:bounds[k+1]] for k in range(n_auctions)]
+
+    def copy(self) -> "BidBook":
+        book = BidBook.__new__(BidBook)
+        book.auction_ids = self.auction_ids
+        book.index = self.index
+        book.auction = list(self.auction)
+        book.slot = list(self.slot)
+        book.gold = list(self.gold)
+        book.max_gold = list(self.max_gold)
+        book.n_max = list(self.n_max)
+        return book
@@ -0,0 +1,67 @@
+import math
+import numbers
+from typing import Dict, List, Tuple
+
+from dnd_auction_game.wire import decode
+
+
+############################################################################################
+#
+# bid_intake
+#   Checks a whole bid message from an agent before anything touches the auction house.
+#
+#   A message is rejected as a whole (BidRejected, no bids are placed) when it is larger
+#   than max_bytes (checked before decoding), is not a dict, or names more auctions than
+#   there are in the round. Inside a valid message, entries for unknown auctions or with
+#   a gold value that is not a number are rejected one by one. Bids below 1 gold are not
+#   bids and are dropped.
+#
+#   What is left goes to AuctionHouse.register_bids in one call, which applies the gold
+#   check in the order the agent sent the bids (like register_bid one by one).
+#
+############################################################################################
+
+
+class BidRejected(ValueError):
+    pass
+
+
+def read_bids(data, wire_format:str, current_auctions:Dict[str, dict], max_bytes:int) -> Tuple[List[Tuple[str, int]], int]:
+    # returns ([(auction_id, gold), ...], number of rejected entries)
+    if len(data) > max_bytes:
+        raise BidRejected("bid message of {} bytes, the limit is {}".format(len(data), max_bytes))
+
+    try:
+        bids = decode(data, wire_format)
+    except Exception:
+        raise BidRejected("bid message could not be decoded")
+
+    return check_bids(bids, current_auctions)
+
+
+def check_bids(bids:dict, current_auctions:Dict[str, dict]) -> Tuple[List[Tuple[str, int]], int]:
+    # the checks of read_bids for a bid dict that is already decoded (the simulator)
+    if not isinstance(bids, dict):
+        raise BidRejected("bid message must be an object of auction_id: gold")
+
+    if len(bids) > len(current_auctions):
+        raise BidRejected("bids for {} auctions, the round has {}".format(len(bids), len(current_auctions)))
+
+    valid = []
+    n_rejected = 0
+    for auction_id, gold in bids.items():
+        if auction_id not in current_auctions:
+            n_rejected += 1
+            continue
+
+        if type(gold) is not int:
+            # floats are rounded down, numpy numbers are fine too (simulator agents)
+            if isinstance(gold, bool) or not isinstance(gold, numbers.Real) or not math.isfinite(gold):
+                n_rejected += 1
+                continue
+            gold = int(gold)
+
+        if gold >= 1:
+            valid.append((auction_id, gold))
+
+    return valid, n_rejected
@@ -0,0 +1,132 @@
+import os
+import pickle
+from typing import List
+
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.log_writer import LogWriter
+from dnd_auction_game.metrics import NULL_METRICS
+
+
+############################################################################################
+#
+# Checkpointer
+#   Saves the auction house so a server restart continues the game at the exact round.
+#
+#   snapshot.pkl  a full AuctionHouse.snapshot() (agents, bids, schedule, rng states), taken
+#                 when the checkpointer is attached and then every `every` rounds.
+#   wal.pkl       append-only log of the journal (add_agent, register_bids, process_all_bids,
+#                 prepare_auction, start, ...) since the snapshot, one pickle frame per round.
+#
+#   Restoring loads the snapshot and replays the journal - the rng states are part of the
+#   snapshot, so the replay draws the same auctions and rolls.
+#   All pickling and file writes happen in a LogWriter thread, off the event loop.
+#   Every record has a sequence number, so a wal that was not truncated (crash right after
+#   a snapshot) is skipped correctly.
+#
+############################################################################################
+
+SNAPSHOT_FILE = "snapshot.pkl"
+WAL_FILE = "wal.pkl"
+
+
+class CheckpointSink:
+    flush_when_idle = True
+
+    def __init__(self, directory:str, metrics=NULL_METRICS):
+        self.directory = directory
+        self.metrics = metrics
+        os.makedirs(directory, exist_ok=True)
+        self.wal = open(os.path.join(directory, WAL_FILE), "ab")
+
+    def write(self, records:List[tuple]):
+        for kind, seq, payload in records:
+            with self.metrics.phase("checkpoint_pickle"):
+                if kind == "wal":
+                    pickle.dump((seq, payload), self.wal, protocol=pickle.HIGHEST_PROTOCOL)
+                else:
+                    self._write_snapshot(seq, payload)
+
+    def _write_snapshot(self, seq:int, snapshot:dict):
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as fp:
+            pickle.dump((seq, snapshot), fp, protocol=pickle.HIGHEST_PROTOCOL)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, path)
+
+        # everything in the wal is now part of the snapshot
+        self.wal.close()
+        self.wal = open(os.path.join(self.directory, WAL_FILE), "wb")
+
+    def flush(self):
+        self.wal.flush()
+
+    def close(self):
+        self.wal.close()
+
+
+class Checkpointer:
+    def __init__(self, directory:str, every:int=10, metrics=NULL_METRICS):
+        if every < 1:
+            raise ValueError("every must be at least 1, got: {}".format(every))
+
+        self.directory = directory
+        self.every = every
+        self.seq = 0
+        self.house : AuctionHouse = None
+        self.writer = LogWriter(CheckpointSink(directory, metrics=metrics))
+
+    def attach(self, house:AuctionHouse):
+        # start journaling the house, with a fresh snapshot as the base
+        self.house = house
+        house.journal = []
+        self.snapshot()
+
+    def snapshot(self):
+        self.seq += 1
+        self.house.journal = []
+        self.writer.write(("snapshot", self.seq, self.house.snapshot()))
+
+    def record(self):
+        # call once per tick: saves what happened since the last call, and snapshots every `every` rounds
+        house = self.house
+        if house.journal:
+            self.seq += 1
+            self.writer.write(("wal", self.seq, house.journal))
+            house.journal = []
+
+        if house.round_counter > 0 and house.round_counter % self.every == 0:
+            self.snapshot()
+
+    def close(self):
+        self.writer.close()
+
+    def restore(self) -> AuctionHouse:
+        # the house as of the last record, or None if there is no checkpoint
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, "rb") as fp:
+            snapshot_seq, snapshot = pickle.load(fp)
+
+        house = AuctionHouse.from_snapshot(snapshot, open_logs=False)
+        self.seq = max(self.seq, snapshot_seq)
+
+        wal_path = os.path.join(self.directory, WAL_FILE)
+        if os.path.isfile(wal_path):
+            with open(wal_path, "rb") as fp:
+                while True:
+                    try:
+                        seq, events = pickle.load(fp)
+                    except Exception:
+                        break # end of file, or the last record was cut short by the crash
+
+                    if seq > snapshot_seq:
+                        house.replay(events)
+                        self.seq = max(self.seq, seq)
+
+        if house.save_logs and house.log_file is not None:
+            house._open_logs()
+        return house
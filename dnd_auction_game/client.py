@@ -1,23 +1,74 @@
 
 import random
 import asyncio
+import inspect
 import json
 import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
 import machineid
 import websockets
 from websockets.exceptions import ConnectionClosedError, ConnectionClosedOK
 
+from dnd_auction_game.wire import FORMAT_JSON, FORMATS, format_available, encode, decode, encode_json
+from dnd_auction_game.log_writer import LogWriter, RotatingJsonLinesSink
+
+
+############################################################################################
+#
+# AuctionGameClient
+#   Connects an agent to the server and calls the bid callback every round.
+#
+#   The callback can be a normal function or an `async def`. A normal function runs in the
+#   event loop, so while it computes the socket is not served (pings, the next round).
+#   run(..., executor="thread") runs it in a worker thread instead, "process" in a worker
+#   process (the callback must then be picklable, e.g. a module level function, and an agent
+#   object is copied for every call so it cannot keep state).
+#
+#   With run(..., deadline=seconds) a callback that has not returned its bids that long
+#   after the round arrived is given up and the fallback bids ({} - no bids) are sent. A
+#   thread cannot be stopped, so while it still runs the next rounds get the fallback too.
+#   A deadline for a normal function implies executor="thread".
+#
+#   Every round is logged to <log_dir>/agent_<agent id>_<time>_<pid>_<n>.jsonl by a
+#   LogWriter thread with one open file. log_compress=True gzips it, log_max_bytes starts
+#   a new part file when it gets that big, save_logs=False turns the log off.
+#
+############################################################################################
+
 
 class AuctionGameClient:
-    def __init__(self, host:str, agent_name:str, token:str="play123", player_id:str="<identifier>", port:int=8000):
+    def __init__(self, host:str, agent_name:str, token:str="play123", player_id:str="<identifier>", port:int=8000, protocol:int=1, wire_format:str=FORMAT_JSON, game_id:str=None,
+                 save_logs:bool=True, log_dir:str="logs", log_compress:bool=False, log_max_bytes:int=0, verbose:bool=True):
         self.host = host
         self.port = port
         self.player_id = player_id
+        self.game_id = game_id # None: the default game of the server
+
+        # protocol 2: the server only sends what changed each round, the full view is rebuilt here
+        if protocol not in (1, 2):
+            raise ValueError("Unknown protocol: {}".format(protocol))
+        self.protocol = protocol
+
+        # "json" (text frames) or "msgpack" (binary frames, needs the msgpack package)
+        if wire_format not in FORMATS:
+            raise ValueError("Unknown wire format: '{}'".format(wire_format))
+        if not format_available(wire_format):
+            raise ImportError("wire format '{}' needs the {} package".format(wire_format, wire_format))
+        self.wire_format = wire_format
+
+        self._view = DeltaView()
+        # raw message => round data and round data => log line, set by MultiAgentClient to decode
+        # and encode a round once for all its agents
+        self.round_reader = None
+        self.log_encoder = encode_json
+        self.verbose = verbose
 
         self.token = token
         self.agent_name = agent_name        
         self.log_file = None
+        self.log_writer : LogWriter = None
         
         if len(self.agent_name) < 2:
             raise ValueError("Agent name is too short: '{}'".format(self.agent_name))
@@ -30,44 +81,142 @@ class AuctionGameClient:
         else:
             self.agent_id = machineid.hashed_id('auction-game')
         
-        if not os.path.isdir("logs"):            
-            print("unable to find ./logs => creating dir.")
-            os.makedirs("logs")
-        
-        n_id = len(os.listdir("logs"))
-        self.log_file = os.path.join("logs", "agent_{}_n{}.jsonl".format(self.agent_id, n_id))
-        
-        print("logging to file: '{}'".format(self.log_file))
+        self.save_logs = save_logs
+        self.log_dir = log_dir
+        self.log_compress = log_compress
+        self.log_max_bytes = log_max_bytes
+
+        self.missed_rounds = 0 # rounds where the fallback bids were sent
 
 
-    def run(self, bid_callback):
-        asyncio.run(self._internal_run(bid_callback))
+    def run(self, bid_callback, executor:str=None, deadline:float=None, fallback:dict=None):
+        # executor: None (in the event loop), "thread", "process" or a concurrent.futures.Executor
+        # deadline: seconds after the round arrived, fallback: the bids sent instead (default: none)
+        self.open_log()
+        try:
+            asyncio.run(self._internal_run(bid_callback, executor=executor, deadline=deadline, fallback=fallback))
+        finally:
+            self.close_log()
         print("<run done>")
 
-    async def _internal_run(self, bid_callback):
+    def open_log(self):
+        if not self.save_logs or self.log_writer is not None:
+            return
+        if self.verbose and not os.path.isdir(self.log_dir):
+            print("unable to find {} => creating dir.".format(self.log_dir))
+
+        sink = RotatingJsonLinesSink(self.log_dir, "agent_{}".format(self.agent_id), compress=self.log_compress, max_bytes=self.log_max_bytes)
+        self.log_file = sink.path
+        self.log_writer = LogWriter(sink)
+        if self.verbose:
+            print("logging to file: '{}'".format(self.log_file))
+
+    def close_log(self):
+        if self.log_writer is not None:
+            self.log_writer.close()
+            self.log_writer = None
+
+    def _make_executor(self, bid_callback, executor, deadline:float):
+        # (executor, owned) - owned executors are shut down when the game is over
+        if inspect.iscoroutinefunction(bid_callback):
+            if executor is not None:
+                raise ValueError("an async bid callback runs in the event loop, it cannot use an executor")
+            return None, False
+        if isinstance(executor, Executor):
+            return executor, False
+
+        if executor is None and deadline is not None:
+            executor = "thread"
+        if executor is None:
+            return None, False
+        if executor == "thread":
+            return ThreadPoolExecutor(max_workers=1, thread_name_prefix="bid_callback"), True
+        if executor == "process":
+            return ProcessPoolExecutor(max_workers=1), True
+        raise ValueError("Unknown executor: '{}'".format(executor))
+
+    async def _call_bid_callback(self, bid_callback, executor:Executor, deadline:float, fallback:dict, received:float, args:tuple):
+        if self._pending is not None:
+            if not self._pending.done():
+                # the callback of an earlier round is still running
+                self.missed_rounds += 1
+                print("<bid callback still busy with an earlier round, sending the fallback bids>")
+                return fallback
+            self._pending = None
+
+        if executor is None and not inspect.iscoroutinefunction(bid_callback):
+            bids = bid_callback(*args)
+            if inspect.isawaitable(bids): # e.g. an object with an async __call__
+                bids = await bids
+            return bids
+
+        if executor is None:
+            call = asyncio.ensure_future(bid_callback(*args))
+        else:
+            call = asyncio.get_running_loop().run_in_executor(executor, bid_callback, *args)
+
+        if deadline is None:
+            return await call
+
+        try:
+            # shield: a timed out executor call keeps running, it is waited for next round
+            return await asyncio.wait_for(asyncio.shield(call), timeout=max(0.0, deadline - (time.monotonic() - received)))
+        except asyncio.TimeoutError:
+            if executor is None:
+                call.cancel()
+            else:
+                self._pending = call
+            self.missed_rounds += 1
+            print("<bid callback missed the deadline of {:.3f}s, sending the fallback bids>".format(deadline))
+            return fallback
+
+    async def _internal_run(self, bid_callback, executor=None, deadline:float=None, fallback:dict=None):
+        executor, owned = self._make_executor(bid_callback, executor, deadline)
+        if fallback is None:
+            fallback = {}
+        self._pending = None
+
+        try:
+            await self._play(bid_callback, executor, deadline, fallback)
+        finally:
+            if owned:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _play(self, bid_callback, executor:Executor, deadline:float, fallback:dict):
         agent_info = {}
         agent_info["name"] = self.agent_name
         agent_info["a_id"] = self.agent_id
         agent_info["player_id"] = self.player_id[0:128]
+        if self.protocol != 1:
+            agent_info["protocol"] = self.protocol
+        if self.wire_format != FORMAT_JSON:
+            agent_info["format"] = self.wire_format
 
-        connection_str = "ws://{}:{}/ws/{}".format(self.host, self.port, self.token)
-        print("connecting to: {}".format(connection_str))
+        if self.game_id is None:
+            connection_str = "ws://{}:{}/ws/{}".format(self.host, self.port, self.token)
+        else:
+            connection_str = "ws://{}:{}/ws/{}/{}".format(self.host, self.port, self.game_id, self.token)
+        if self.verbose:
+            print("connecting to: {}".format(connection_str))
 
         try:
             async with websockets.connect(connection_str) as sock:
-                print("<connected to game server>")
                 agent_info_json = json.dumps(agent_info)
-                print(agent_info_json)
+                if self.verbose:
+                    print("<connected to game server>")
+                    print(agent_info_json)
                 await sock.send(agent_info_json)
 
          
                 while True:
                     round_data_raw = await sock.recv()
-                    round_data = json.loads(round_data_raw)
+                    received = time.monotonic()
+                    round_data = self._read_round(round_data_raw)
                     
                     round_data["current_agent"] = self.agent_id
-                    with open(self.log_file, "a") as fp:
-                        fp.write("{}\n".format(json.dumps(round_data)))
+                    if self.log_writer is not None:
+                        # encoded now, the callback gets the same dicts and may change them
+                        self.log_writer.write(self.log_encoder(round_data))
                         
                     #                     
                     current_round = round_data["round"]
@@ -77,8 +226,9 @@ class AuctionGameClient:
                     reminder_random_info["bank_interest_per_round"] = round_data["reminder_bank_interest"]
                     reminder_random_info["bank_limit_per_round"] = round_data["reminder_bank_limit"]
                     
-                    new_bids = bid_callback(self.agent_id, current_round, round_data["states"], round_data["auctions"], round_data["prev_auctions"], reminder_random_info)                    
-                    await sock.send(json.dumps(new_bids))
+                    args = (self.agent_id, current_round, round_data["states"], round_data["auctions"], round_data["prev_auctions"], reminder_random_info)
+                    new_bids = await self._call_bid_callback(bid_callback, executor, deadline, fallback, received, args)
+                    await sock.send(encode(new_bids, self.wire_format))
         
         except ConnectionClosedError:
             print("<ERROR: Connection to server closed>")
@@ -86,17 +236,41 @@ class AuctionGameClient:
         except ConnectionClosedOK:
             pass
 
+    def _read_round(self, raw) -> dict:
+        if self.round_reader is not None:
+            return self.round_reader(raw)
 
+        round_data = decode(raw, self.wire_format)
+        if "protocol" in round_data:
+            round_data = self._apply_delta(round_data)
+        return round_data
 
-      
-
-
-
-
-
-
-
+    def _apply_delta(self, message:dict) -> dict:
+        return self._view.apply(message)
 
 
+class DeltaView:
+    # the states and bank schedule of a protocol 2 connection
+    def __init__(self):
+        self.states = {}
+        self.schedule = None
 
+    def apply(self, message:dict) -> dict:
+        # rebuild the protocol 1 round data from a protocol 2 message
+        if message["type"] == "full":
+            self.states = message["states"]
+            self.schedule = message["schedule"]
+        else:
+            self.states.update(message["states"])
 
+        next_round = message["round"] + 1 # the reminders start at the next round
+        round_data = {
+            "round": message["round"],
+            "states": {a_id: dict(s) for a_id, s in self.states.items()}, # a copy - the agent may change it
+            "auctions": message["auctions"],
+            "prev_auctions": message["prev_auctions"],
+            "reminder_gold_income": self.schedule["gold_income"][next_round:],
+            "reminder_bank_limit": self.schedule["bank_limit"][next_round:],
+            "reminder_bank_interest": self.schedule["bank_interest"][next_round:],
+        }
+        return round_data
@@ -1,48 +1,194 @@
-
-
-
-from typing import List
+import time
+import asyncio
+from collections import deque
+from typing import Dict, List
 from fastapi import (
     WebSocket,
 )
 
+from dnd_auction_game.wire import FORMAT_JSON, encode
+from dnd_auction_game.metrics import NULL_METRICS
+
+
+class ConnectionInfo:
+    def __init__(self, name:str=None, a_id:str=None, protocol:int=1, wire_format:str=FORMAT_JSON):
+        self.name = name
+        self.a_id = a_id
+        self.wire_format = wire_format
+
+        # protocol 2 clients get a full message first (synced), then only deltas
+        self.protocol = protocol
+        self.synced = False
+
+        # send latency of the round broadcasts, in seconds
+        self.n_sends = 0
+        self.n_timeouts = 0
+        self.last_send_latency = 0.0
+        self.max_send_latency = 0.0
+        self.total_send_latency = 0.0
+
+        # round messages sent and bid messages received - the agent has answered the current
+        # round when they are equal, a late answer to an earlier round does not count for it
+        self.rounds_sent = 0
+        self.bid_messages = 0
+
+        # bids from the agent, see bid_intake.py
+        self.bids_accepted = 0
+        self.bids_rejected = 0
+        self.messages_rejected = 0
+
+    def record_bids(self, accepted:int, rejected:int):
+        self.bids_accepted += accepted
+        self.bids_rejected += rejected
+
+    def record_send(self, latency:float):
+        self.n_sends += 1
+        self.last_send_latency = latency
+        self.total_send_latency += latency
+        if latency > self.max_send_latency:
+            self.max_send_latency = latency
+
+    def report(self) -> dict:
+        mean = self.total_send_latency / max(1, self.n_sends)
+        return {
+            "name": self.name,
+            "a_id": self.a_id,
+            "sends": self.n_sends,
+            "timeouts": self.n_timeouts,
+            "last_ms": self.last_send_latency * 1000.0,
+            "mean_ms": mean * 1000.0,
+            "max_ms": self.max_send_latency * 1000.0,
+            "bids_accepted": self.bids_accepted,
+            "bids_rejected": self.bids_rejected,
+            "messages_rejected": self.messages_rejected,
+        }
+
+    @property
+    def variant(self) -> str:
+        if self.protocol < 2:
+            return None
+        return "delta" if self.synced else "full"
+
 
 class ConnectionManager:
-    def __init__(self):
+    metrics = NULL_METRICS # the server sets its Metrics on the agent connections of a game
+
+    def __init__(self, send_timeout:float=1.0):
         self.active_connections: List[WebSocket] = []
+        self.info: Dict[WebSocket, ConnectionInfo] = {}
+
+        # a socket that can not take a broadcast within send_timeout seconds is dropped
+        self.send_timeout = send_timeout
+        self.dropped: deque = deque(maxlen=100) # latency reports of the last connections dropped for being too slow
+        self.n_dropped = 0
+        self._closing = set()
 
-    async def add_connection(self, websocket: WebSocket):
+        self.last_payload_bytes = 0
+
+    async def add_connection(self, websocket: WebSocket, name:str=None, a_id:str=None, protocol:int=1, wire_format:str=FORMAT_JSON):
         self.active_connections.append(websocket)
+        self.info[websocket] = ConnectionInfo(name=name, a_id=a_id, protocol=protocol, wire_format=wire_format)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        
+        if websocket in self.info:
+            del self.info[websocket]
+
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+
     async def disconnect_all(self):
         print("disconnect all")
         for ws in self.active_connections:
             try:
-                await ws.close()            
+                await ws.close()
             except:
                 print("error closing connection")
                 pass
 
         self.active_connections = []
+        self.info = {}
 
     async def send_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
+        info = self.info.get(websocket)
+        wire_format = info.wire_format if info is not None else FORMAT_JSON
+        await self._send(websocket, encode(message, wire_format))
 
-    async def broadcast(self, message: dict):
-        to_disconnect = []
-        for connection in self.active_connections:            
-            try:
-                await connection.send_json(message)                
-            except:
-                to_disconnect.append(connection)
+    async def _send(self, websocket: WebSocket, data):
+        if isinstance(data, bytes):
+            await websocket.send_bytes(data)
+        else:
+            await websocket.send_text(data)
+
+    async def _timed_send(self, websocket: WebSocket, data):
+        start = time.perf_counter()
+        await asyncio.wait_for(self._send(websocket, data), timeout=self.send_timeout)
+
+        info = self.info.get(websocket)
+        if info is not None:
+            info.record_send(time.perf_counter() - start)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(), timeout=self.send_timeout)
+        except:
+            pass
+
+    async def broadcast(self, message: dict, variants: Dict[str, dict]=None):
+        # every message is encoded once, then the same text is sent to everyone at the same time,
+        # so one slow client does not delay the others.
+        # variants: other versions of the message, picked by ConnectionInfo.variant (ex: protocol 2 "full"/"delta")
+        encoded = {}
+        self.last_payload_bytes = 0
+        bytes_sent = 0
+
+        connections = list(self.active_connections)
+        sends = []
+        for ws in connections:
+            info = self.info.get(ws)
+            variant = info.variant if info is not None else None
+            if variants is None or variant not in variants:
+                variant = None
+            wire_format = info.wire_format if info is not None else FORMAT_JSON
+
+            key = (variant, wire_format)
+            if key not in encoded:
+                encoded[key] = encode(message if variant is None else variants[variant], wire_format)
+                self.last_payload_bytes += len(encoded[key])
+                self.metrics.payload_bytes.observe(len(encoded[key]))
+
+            bytes_sent += len(encoded[key])
+            if info is not None:
+                info.rounds_sent += 1 # before the send: the answer can come before the send returns
+            sends.append(self._timed_send(ws, encoded[key]))
+
+        self.metrics.bytes_sent.inc(bytes_sent)
+
+        results = await asyncio.gather(*sends, return_exceptions=True)
+
+        for connection, result in zip(connections, results):
+            if not isinstance(result, BaseException):
+                info = self.info.get(connection)
+                if info is not None and info.protocol >= 2:
+                    info.synced = True
+                continue
+
+            if isinstance(result, asyncio.TimeoutError):
+                info = self.info.get(connection)
+                if info is not None:
+                    info.n_timeouts += 1
+                    self.dropped.append(info.report())
+                self.n_dropped += 1
+                self.metrics.send_timeouts.inc()
+                print("agent: {} was too slow to receive the round - dropped.".format(info.a_id if info is not None else "?"))
 
-        for connection in to_disconnect:
-            await connection.close()
             self.disconnect(connection)
-                
-            
 
+            # closing can hang on a stalled client as well, so it is done in the background
+            task = asyncio.create_task(self._close(connection))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
 
+    def latency_report(self) -> List[dict]:
+        report = [info.report() for info in self.info.values()]
+        report.sort(key=lambda x:x["mean_ms"], reverse=True)
+        return report
@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import argparse
+from typing import Dict, List
+
+import numpy as np
+
+from dnd_auction_game.wire import decode_json
+
+
+############################################################################################
+#
+# game_log
+#   A compressed, columnar format for the game logs, written as a folder:
+#       meta.json           agent ids (the agent column is an index into this list),
+#                           the bank schedule of each game (gold_income[0] is the income
+#                           of round first_round) and the list of chunks
+#       chunk_00000.npz     typed numpy columns for a block of rounds (zip/deflate)
+#       chunk_00001.npz     ...
+#
+#   Tables (each column is stored as "<table>.<column>" in the chunks):
+#       rounds    game, round, n_agents, n_auctions
+#       agents    game, round, agent, gold, points           (gold/points sent at the start of the round)
+#       auctions  game, round, auction, die, num, bonus, reward, n_bids, win_gold
+#       bids      game, round, auction, agent, gold, rank, won
+#   "auction" is the number in the auction id ("a17" => 17), "round" for auctions/bids is
+#   the round the auction was held in. Auctions of the last round are never settled, so
+#   they are not in the log.
+#
+#   ColumnarSink is a LogWriter sink that takes the same round states as the .jsonln log,
+#   GameLog reads it back (only the columns asked for are read and decompressed), and
+#   convert_jsonln turns an existing .jsonln/.jsonl log into this format:
+#
+#   python -m dnd_auction_game.game_log auction_house_log_1.jsonln auction_house_log_1.cols
+#
+############################################################################################
+
+
+TABLES = {
+    "rounds":   [("game", np.int32), ("round", np.int32), ("n_agents", np.int32), ("n_auctions", np.int32)],
+    "agents":   [("game", np.int32), ("round", np.int32), ("agent", np.int32), ("gold", np.int64), ("points", np.int64)],
+    "auctions": [("game", np.int32), ("round", np.int32), ("auction", np.int64), ("die", np.int16), ("num", np.int16),
+                 ("bonus", np.int16), ("reward", np.int32), ("n_bids", np.int32), ("win_gold", np.int64)],
+    "bids":     [("game", np.int32), ("round", np.int32), ("auction", np.int64), ("agent", np.int32), ("gold", np.int64),
+                 ("rank", np.int32), ("won", np.bool_)],
+}
+
+
+def _auction_number(auction_id:str) -> int:
+    return int(auction_id[1:])
+
+
+class ColumnarSink:
+    flush_when_idle = False # a chunk is written every chunk_rounds rounds, on flush() and on close()
+
+    def __init__(self, path:str, chunk_rounds:int=64):
+        self.path = path
+        self.chunk_rounds = chunk_rounds
+        os.makedirs(path, exist_ok=True)
+
+        self.meta = {"version": 1, "agents": [], "schedules": [], "chunks": []}
+        meta_file = os.path.join(path, "meta.json")
+        if os.path.isfile(meta_file):
+            with open(meta_file) as fp:
+                self.meta = json.load(fp)
+
+        self.slots = {a_id: k for k, a_id in enumerate(self.meta["agents"])}
+        self.game = len(self.meta["schedules"]) - 1
+        # kept in meta.json, so a server that restarts from a checkpoint continues the game
+        self.last_round = self.meta.get("last_round")
+        self._new_buffers()
+
+    def _new_buffers(self):
+        self.buffers = {table: {name: [] for name, _ in columns} for table, columns in TABLES.items()}
+        self.n_buffered_rounds = 0
+
+    def _slot(self, a_id:str) -> int:
+        slot = self.slots.get(a_id)
+        if slot is None:
+            slot = len(self.meta["agents"])
+            self.slots[a_id] = slot
+            self.meta["agents"].append(a_id)
+        return slot
+
+    def write(self, records:List[dict]):
+        for state in records:
+            self._append(state)
+            if self.n_buffered_rounds >= self.chunk_rounds:
+                self._write_chunk()
+
+    def _append(self, state:dict):
+        r = state["round"]
+        if self.last_round is None or r <= self.last_round:
+            # the round counter starts over => a new game
+            self.game += 1
+            self.meta["schedules"].append({
+                "first_round": r + 1, # the reminders sent in round r start at the next round
+                "gold_income": state.get("reminder_gold_income", []),
+                "bank_limit": state.get("reminder_bank_limit", []),
+                "bank_interest": state.get("reminder_bank_interest", []),
+            })
+        self.last_round = r
+        game = self.game
+
+        b = self.buffers["rounds"]
+        b["game"].append(game)
+        b["round"].append(r)
+        b["n_agents"].append(len(state["states"]))
+        b["n_auctions"].append(len(state["auctions"]))
+
+        b = self.buffers["agents"]
+        for a_id, s in state["states"].items():
+            b["game"].append(game)
+            b["round"].append(r)
+            b["agent"].append(self._slot(a_id))
+            b["gold"].append(s["gold"])
+            b["points"].append(s["points"])
+
+        ba = self.buffers["auctions"]
+        bb = self.buffers["bids"]
+        for auction_id, a in state["prev_auctions"].items():
+            auction = _auction_number(auction_id)
+            bids = a["bids"]
+            win_gold = bids[0]["gold"] if bids else 0
+
+            ba["game"].append(game)
+            ba["round"].append(r - 1)
+            ba["auction"].append(auction)
+            ba["die"].append(a["die"])
+            ba["num"].append(a["num"])
+            ba["bonus"].append(a["bonus"])
+            ba["reward"].append(a["reward"])
+            ba["n_bids"].append(len(bids))
+            ba["win_gold"].append(win_gold)
+
+            for rank, bid in enumerate(bids):
+                bb["game"].append(game)
+                bb["round"].append(r - 1)
+                bb["auction"].append(auction)
+                bb["agent"].append(self._slot(bid["a_id"]))
+                bb["gold"].append(bid["gold"])
+                bb["rank"].append(rank)
+                bb["won"].append(bid["gold"] == win_gold)
+
+        self.n_buffered_rounds += 1
+
+    def _write_chunk(self):
+        if self.n_buffered_rounds == 0:
+            return
+
+        arrays = {}
+        for table, columns in TABLES.items():
+            for name, dtype in columns:
+                arrays["{}.{}".format(table, name)] = np.asarray(self.buffers[table][name], dtype=dtype)
+
+        chunk = "chunk_{:05d}.npz".format(len(self.meta["chunks"]))
+        np.savez_compressed(os.path.join(self.path, chunk), **arrays)
+        self.meta["chunks"].append(chunk)
+        self._write_meta()
+        self._new_buffers()
+
+    def _write_meta(self):
+        self.meta["last_round"] = self.last_round
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w") as fp:
+            json.dump(self.meta, fp)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def flush(self):
+        self._write_chunk()
+
+    def close(self):
+        self._write_chunk()
+
+
+class GameLog:
+    def __init__(self, path:str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as fp:
+            self.meta = json.load(fp)
+
+    @property
+    def agents(self) -> List[str]:
+        return self.meta["agents"]
+
+    @property
+    def schedules(self) -> List[dict]:
+        return self.meta["schedules"]
+
+    @property
+    def num_games(self) -> int:
+        return len(self.meta["schedules"])
+
+    def load(self, table:str, columns:List[str]=None, game:int=None) -> Dict[str, np.ndarray]:
+        # columns=None loads all columns of the table. Only the requested columns are read from the chunks.
+        if table not in TABLES:
+            raise KeyError("Unknown table: '{}', must be one of: {}".format(table, list(TABLES.keys())))
+
+        if columns is None:
+            columns = [name for name, _ in TABLES[table]]
+        wanted = list(columns)
+        if game is not None and "game" not in wanted:
+            wanted.append("game")
+
+        parts = {name: [] for name in wanted}
+        for chunk in self.meta["chunks"]:
+            with np.load(os.path.join(self.path, chunk)) as data:
+                for name in wanted:
+                    parts[name].append(data["{}.{}".format(table, name)])
+
+        dtypes = dict(TABLES[table])
+        out = {}
+        for name in wanted:
+            if parts[name]:
+                out[name] = np.concatenate(parts[name])
+            else:
+                out[name] = np.zeros(0, dtype=dtypes[name])
+
+        if game is not None:
+            mask = out["game"] == game
+            out = {name: values[mask] for name, values in out.items() if name in columns}
+
+        return out
+
+
+def convert_jsonln(src:str, dst:str, chunk_rounds:int=64) -> GameLog:
+    # works for the server logs (auction_house_log_N.jsonln) and the agent logs (logs/agent_*.jsonl)
+    sink = ColumnarSink(dst, chunk_rounds=chunk_rounds)
+    batch = []
+    with open(src) as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            batch.append(decode_json(line))
+            if len(batch) >= chunk_rounds:
+                sink.write(batch)
+                batch = []
+
+    sink.write(batch)
+    sink.close()
+    return GameLog(dst)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a .jsonln game log to the columnar format.")
+    parser.add_argument("src", help="a .jsonln (server) or .jsonl (agent) log")
+    parser.add_argument("dst", help="output folder")
+    parser.add_argument("--chunk-rounds", type=int, default=64)
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.dst, "meta.json")):
+        print("'{}' already holds a game log.".format(args.dst))
+        sys.exit(1)
+
+    log = convert_jsonln(args.src, args.dst, chunk_rounds=args.chunk_rounds)
+    src_size = os.path.getsize(args.src)
+    dst_size = sum(os.path.getsize(os.path.join(args.dst, f)) for f in os.listdir(args.dst))
+    print("converted {} games, {} agents: {:.1f} kB => {:.1f} kB".format(log.num_games, len(log.agents), src_size / 1024.0, dst_size / 1024.0))
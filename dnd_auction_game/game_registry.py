@@ -0,0 +1,228 @@
+import re
+import time
+import asyncio
+from typing import Callable, Dict, List
+
+from dnd_auction_game.connection_manager import ConnectionManager
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.round_clock import RoundClock
+from dnd_auction_game.checkpoint import Checkpointer
+from dnd_auction_game.leadboard import LeadboardCache, standings_delta
+from dnd_auction_game.api import ApiCache
+from dnd_auction_game.metrics import NULL_METRICS
+from dnd_auction_game.profiler import RoundProfiler
+
+
+############################################################################################
+#
+# Game / GameRegistry
+#   One server process can host many games at the same time, each with its own game id.
+#   A Game is everything that used to be module level in server.py: the auction house, the
+#   agent and spectator connections, the caches, the round clock and the tick task that
+#   runs the rounds. All games share the one event loop.
+#
+#   The registry creates a game the first time its id is used (with a factory, so the
+#   server decides about logs and checkpoints), and removes games that have been idle
+#   for idle_timeout seconds: no running game, no connections. Games in `keep` (the
+#   "default" game of the old routes) are never removed.
+#
+############################################################################################
+
+DEFAULT_GAME = "default"
+
+_GAME_ID = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+
+
+def valid_game_id(game_id:str) -> bool:
+    # the id is used in file names (checkpoints), so only a safe set of characters
+    return _GAME_ID.match(game_id) is not None
+
+
+class Game:
+    def __init__(self, game_id:str, auction_house:AuctionHouse, checkpointer:Checkpointer=None, send_timeout:float=1.0, metrics=NULL_METRICS,
+                 profile_rounds:int=0):
+        self.game_id = game_id
+        self.auction_house = auction_house
+        self.checkpointer = checkpointer
+        self.metrics = metrics
+        auction_house.metrics = metrics
+
+        self.connection_manager = ConnectionManager(send_timeout=send_timeout)
+        self.connection_manager.metrics = metrics
+        self.spectators = ConnectionManager(send_timeout=send_timeout)
+        self.leadboard_cache = LeadboardCache()
+        self.api_cache = ApiCache()
+        self.round_clock = RoundClock(time_per_round=auction_house.time_per_round,
+                                      advance_when_all_bids=auction_house.advance_when_all_bids)
+
+        # profiles go next to the logs of the game
+        self.profiler = RoundProfiler(game_id, directory=getattr(auction_house, "log_dir", "."))
+        self.profiler.request(profile_rounds)
+
+        self.task : asyncio.Task = None
+        self.last_active = time.monotonic()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def is_idle(self, now:float, idle_timeout:float) -> bool:
+        if self.auction_house.is_active:
+            return False
+        if self.connection_manager.active_connections or self.spectators.active_connections:
+            return False
+        return now - self.last_active >= idle_timeout
+
+    def leadboard_message(self, kind:str, players:list) -> dict:
+        house = self.auction_house
+        return {"type": kind, "round": house.round_counter, "is_done": house.is_done,
+                "n_players": len(players), "players": players}
+
+    async def push_leadboard(self):
+        old = self.leadboard_cache.standings or []
+        self.leadboard_cache.invalidate()
+        new = self.leadboard_cache.get_standings(self.auction_house)
+        if self.spectators.active_connections:
+            await self.spectators.broadcast(self.leadboard_message("delta", standings_delta(old, new)))
+
+    async def tick(self):
+        auction_house = self.auction_house
+        metrics = self.metrics
+        profiler = self.profiler
+        while True:
+
+            if auction_house.is_active:
+                self.touch()
+                profiler.begin(auction_house.round_counter)
+
+                metrics.rounds.inc()
+                metrics.round_bids.observe(len(auction_house.bid_book))
+                with metrics.phase("process_all_bids"):
+                    auction_house.process_all_bids()
+                try:
+                    with metrics.phase("prepare_auction"):
+                        round_data = auction_house.prepare_auction()
+                except Exception as e:
+                    print("error in prepare_auction ({})".format(self.game_id))
+                    print(e)
+
+                self.api_cache.add_round(auction_house, round_data)
+
+                with metrics.phase("broadcast"):
+                    # server_time (unix time of the broadcast) is only in the messages, not in the logged state
+                    server_time = time.time()
+                    full, delta = auction_house.delta_messages(round_data)
+                    full["server_time"] = server_time
+                    delta["server_time"] = server_time
+                    await self.connection_manager.broadcast(dict(round_data, server_time=server_time), variants={"full": full, "delta": delta})
+
+                if auction_house.round_counter >= auction_house.num_rounds_in_game:
+                    auction_house.finish()
+                    auction_house.flush_logs()
+
+                    await self.connection_manager.disconnect_all()
+
+                if self.checkpointer is not None:
+                    with metrics.phase("checkpoint"):
+                        self.checkpointer.record()
+
+                with metrics.phase("leadboard"):
+                    await self.push_leadboard()
+
+                profiler.end()
+                if not auction_house.is_active and profiler.active:
+                    profiler.cancel() # the game ended before the K rounds
+
+            await self.round_clock.wait()
+
+    def start(self):
+        # needs a running event loop
+        if self.task is None:
+            self.task = asyncio.create_task(self.tick())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        self.profiler.cancel()
+        await self.connection_manager.disconnect_all()
+        await self.spectators.disconnect_all()
+
+        if self.checkpointer is not None:
+            self.checkpointer.record()
+            self.checkpointer.close()
+        self.auction_house.close_logs()
+
+
+class GameRegistry:
+    def __init__(self, factory:Callable[[str], Game], max_games:int=64, idle_timeout:float=600.0, keep:tuple=(DEFAULT_GAME,)):
+        self.factory = factory
+        self.max_games = max_games
+        self.idle_timeout = idle_timeout
+        self.keep = set(keep)
+        self.games : Dict[str, Game] = {}
+
+    def __len__(self) -> int:
+        return len(self.games)
+
+    def get(self, game_id:str) -> Game:
+        # None if there is no such game
+        return self.games.get(game_id)
+
+    def get_or_create(self, game_id:str) -> Game:
+        # None if the id is not valid or the server already runs max_games games
+        game = self.games.get(game_id)
+        if game is not None:
+            return game
+
+        if not valid_game_id(game_id):
+            return None
+
+        if len(self.games) >= self.max_games:
+            print("not creating game '{}', already running {} games.".format(game_id, len(self.games)))
+            return None
+
+        game = self.factory(game_id)
+        self.games[game_id] = game
+        game.start()
+        print("created game '{}' ({} games)".format(game_id, len(self.games)))
+        return game
+
+    async def collect_idle(self) -> List[str]:
+        now = time.monotonic()
+        idle = [game_id for game_id, game in self.games.items()
+                if game_id not in self.keep and game.is_idle(now, self.idle_timeout)]
+
+        for game_id in idle:
+            game = self.games.pop(game_id)
+            await game.close()
+            print("removed idle game '{}' ({} games)".format(game_id, len(self.games)))
+        return idle
+
+    async def run_gc(self, interval:float=30.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.collect_idle()
+            except Exception as e:
+                print("error removing idle games: {}".format(e))
+
+    async def close_all(self):
+        for game_id in list(self.games.keys()):
+            await self.games.pop(game_id).close()
+
+    def summary(self) -> List[dict]:
+        now = time.monotonic()
+        return [{"game_id": game_id,
+                 "round": game.auction_house.round_counter,
+                 "num_rounds": game.auction_house.num_rounds_in_game,
+                 "is_active": game.auction_house.is_active,
+                 "is_done": game.auction_house.is_done,
+                 "n_agents": len(game.auction_house.store),
+                 "n_connections": len(game.connection_manager.active_connections),
+                 "idle_seconds": round(now - game.last_active, 1)}
+                for game_id, game in self.games.items()]
@@ -66,7 +66,7 @@ jjinja_template = """
             </tr>
         </thead>
         <tbody>
-        {% for player in players|sort(attribute='points', reverse=True) %}
+        {% for player in players %}
             <tr class="grade-{{ player.grade|e }}">
                 <td>{{ loop.index }}</td>
                 <td>{{ player.name|e }}</td>
@@ -83,10 +83,96 @@ jjinja_template = """
 """
 
 
+leadboard_template = Template(jjinja_template) # compiled once
+
+
 def generate_leadboard(players, round, is_done):
 
-    template = Template(jjinja_template)
-    return template.render(players=players, round=round, is_done=is_done)
+    return leadboard_template.render(players=players, round=round, is_done=is_done)
+
+
+def grade_for(points, k, n_players):
+    # k: position in the ranking (0 is the leader)
+    rank = (n_players - k) / n_players
+
+    grade = "F"
+
+    if points > 10:
+
+        if rank > 0.89:
+            grade = "A"
+        elif rank > 0.75:
+            grade = "B"
+        elif rank > 0.55:
+            grade = "C"
+        elif rank > 0.35:
+            grade = "D"
+        else:
+            grade = "E"
+
+    return grade
+
+
+def build_standings(auction_house, offset=0, limit=None):
+    # read in ranking order from the auction house's ranking index, O(limit)
+    store = auction_house.store
+    n_players = max(len(store), 1)
+
+    all_players = []
+    for k, slot in enumerate(auction_house.ranking.top(limit, offset), start=offset):
+        name = auction_house.names[store.ids[slot]]
+        points = int(store.points[slot])
+        all_players.append({'grade': grade_for(points, k, n_players), 'name': name, 'gold': int(store.gold[slot]), 'points': points})
+
+    return all_players
+
+
+class LeadboardCache:
+    # the standings and the rendered page are built at most once per round (or when an agent joins),
+    # no matter how many spectators are watching. Only the pages of the last MAX_PAGES distinct top
+    # values are kept, a top past the number of players is the full page.
+    MAX_PAGES = 4
+
+    def __init__(self):
+        self.key = None
+        self.standings = None
+        self.html = {} # top => rendered page
+
+    def invalidate(self):
+        self.key = None
+
+    def _refresh(self, auction_house):
+        key = (auction_house.round_counter, len(auction_house.store), auction_house.is_done)
+        if key != self.key:
+            self.key = key
+            self.standings = build_standings(auction_house)
+            self.html = {}
+
+    def get_standings(self, auction_house):
+        self._refresh(auction_house)
+        return self.standings
+
+    def get_html(self, auction_house, top=None):
+        # top: only show the first top players (for big lobbies)
+        self._refresh(auction_house)
+        if top is not None and top >= len(self.standings):
+            top = None
+
+        if top not in self.html:
+            if len(self.html) >= self.MAX_PAGES:
+                del self.html[next(iter(self.html))] # the oldest
+            players = self.standings if top is None else self.standings[:top]
+            self.html[top] = generate_leadboard(players, auction_house.round_counter, auction_house.is_done)
+        return self.html[top]
+
+
+def standings_delta(old, new):
+    # the rows (by rank) that changed, for the spectator stream
+    changed = []
+    for k, row in enumerate(new):
+        if k >= len(old) or old[k] != row:
+            changed.append(dict(row, rank=k+1))
+    return changed
 
 
 
@@ -0,0 +1,186 @@
+import os
+import gzip
+import time
+import queue
+import itertools
+import threading
+from typing import List
+
+from dnd_auction_game.wire import encode_json
+
+
+############################################################################################
+#
+# LogWriter
+#   Writes log records from a background thread, so the event loop never waits on the disk.
+#   write() only puts the record on a queue. The thread takes everything that is queued,
+#   hands it to the sink in one batch and flushes the file when the queue runs empty
+#   (unless the sink sets flush_when_idle = False, then only on flush() and close()).
+#
+#   A sink is anything with write(records), flush() and close(), see JsonLinesSink.
+#   The records are encoded in the thread - do not change a record after it is written.
+#
+#   RotatingJsonLinesSink is for the agents (AuctionGameClient): it picks a new file name
+#   itself (time, pid and a counter, created with O_EXCL - no listing of the folder, no
+#   clash between agents starting at the same time), can gzip and starts a new part file
+#   after max_bytes.
+#
+############################################################################################
+
+
+class JsonLinesSink:
+    flush_when_idle = True
+
+    def __init__(self, path:str):
+        self.path = path
+        self.fp = open(path, "a")
+
+    def write(self, records:List[dict]):
+        self.fp.write("".join("{}\n".format(encode_json(r)) for r in records))
+
+    def flush(self):
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+_sink_counter = itertools.count()
+
+
+class RotatingJsonLinesSink:
+    # files: <directory>/<prefix>_<time>_<pid>_<n>.jsonl, the next parts .1.jsonl, .2.jsonl, ...
+    # (+ .gz with compress). Records can also be strings that are already json.
+    def __init__(self, directory:str, prefix:str, compress:bool=False, max_bytes:int=0):
+        self.directory = directory
+        self.compress = compress
+        self.max_bytes = max_bytes # of uncompressed json per part, 0: one file
+        # flushing a gzip stream every round would end its blocks early and compress poorly
+        self.flush_when_idle = not compress
+
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        while True:
+            self.base = os.path.join(directory, "{}_{}_{}_{}".format(prefix, stamp, os.getpid(), next(_sink_counter)))
+            self.part = 0
+            try:
+                self.fp = self._open()
+                break
+            except FileExistsError:
+                continue
+
+        self.path = self._part_path(0)
+        self.paths = [self.path]
+        self.n_bytes = 0
+
+    def _part_path(self, part:int) -> str:
+        ext = ".jsonl.gz" if self.compress else ".jsonl"
+        if part == 0:
+            return self.base + ext
+        return "{}.{}{}".format(self.base, part, ext)
+
+    def _open(self):
+        path = self._part_path(self.part)
+        if self.compress:
+            return gzip.open(path, "xt", encoding="utf-8")
+        return open(path, "x", encoding="utf-8")
+
+    def write(self, records:List[dict]):
+        lines = ["{}\n".format(r if isinstance(r, str) else encode_json(r)) for r in records]
+        if self.max_bytes <= 0:
+            self.fp.write("".join(lines))
+            return
+
+        start = 0
+        for k, line in enumerate(lines):
+            if self.n_bytes > 0 and self.n_bytes + len(line) > self.max_bytes:
+                self.fp.write("".join(lines[start:k]))
+                self._next_part()
+                start = k
+            self.n_bytes += len(line)
+        self.fp.write("".join(lines[start:]))
+
+    def _next_part(self):
+        self.fp.close()
+        self.part += 1
+        self.fp = self._open()
+        self.path = self._part_path(self.part)
+        self.paths.append(self.path)
+        self.n_bytes = 0
+
+    def flush(self):
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+_FLUSH = object()
+_CLOSE = object()
+
+
+class LogWriter:
+    def __init__(self, sink, max_batch:int=1024):
+        self.sink = sink
+        self.max_batch = max_batch
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        if self._closed:
+            raise ValueError("write to a closed LogWriter")
+        self._queue.put(record)
+
+    def flush(self, wait:bool=False):
+        # wait=True blocks until everything written so far is on disk - not for use in the event loop
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        if wait:
+            done.wait()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = []
+            flushed = []
+            closing = False
+            for item in batch:
+                if item is _CLOSE:
+                    closing = True
+                elif isinstance(item, tuple) and len(item) == 2 and item[0] is _FLUSH:
+                    flushed.append(item[1])
+                else:
+                    records.append(item)
+
+            try:
+                if records:
+                    self.sink.write(records)
+
+                if closing:
+                    self.sink.close()
+                elif flushed or (getattr(self.sink, "flush_when_idle", True) and self._queue.empty()):
+                    self.sink.flush()
+            except Exception as e:
+                print("error in log writer: {}".format(e))
+
+            for done in flushed:
+                done.set()
+
+            if closing:
+                return
@@ -0,0 +1,200 @@
+import time
+import bisect
+import threading
+from typing import Callable, Dict, List, Tuple
+
+
+############################################################################################
+#
+# metrics
+#   Counters and histograms for the hot path of the server, shown in the Prometheus text
+#   format on /metrics.
+#
+#   Metrics         collects. Phases of a round are timed with `with metrics.phase("broadcast"):`
+#   NullMetrics     the same methods doing nothing, for when the instrumentation is off
+#                   (AH_METRICS=0) and for the simulator/tournament. An AuctionHouse has
+#                   NULL_METRICS until the server gives it its Metrics.
+#
+#   The phases of a round (ah_phase_seconds{phase=...}):
+#     process_all_bids, prepare_auction (with generate_auctions, bank_update, prev_state and
+#     log_write inside it), broadcast, checkpoint (on the event loop) and checkpoint_pickle
+#     (in the checkpoint writer thread), leadboard.
+#
+############################################################################################
+
+
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _labels(label:str, value) -> str:
+    if label is None:
+        return ""
+    return '{{{}="{}"}}'.format(label, value)
+
+
+class Counter:
+    def __init__(self, name:str, help:str, label:str=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values : Dict[str, float] = {}
+
+    def inc(self, n:float=1, label_value:str=None):
+        self.values[label_value] = self.values.get(label_value, 0) + n
+
+    def render(self, lines:List[str]):
+        lines.append("# HELP {} {}".format(self.name, self.help))
+        lines.append("# TYPE {} counter".format(self.name))
+        for value, n in self.values.items():
+            lines.append("{}{} {}".format(self.name, _labels(self.label, value), n))
+
+
+class Gauge:
+    # the value is read when /metrics is asked for: fn() returns a number, or {label value: number}
+    def __init__(self, name:str, help:str, fn:Callable, label:str=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.label = label
+
+    def render(self, lines:List[str]):
+        lines.append("# HELP {} {}".format(self.name, self.help))
+        lines.append("# TYPE {} gauge".format(self.name))
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {None: values}
+        for value, n in values.items():
+            lines.append("{}{} {}".format(self.name, _labels(self.label, value), n))
+
+
+class Histogram:
+    def __init__(self, name:str, help:str, buckets:Tuple[float, ...]=TIME_BUCKETS, label:str=None):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        self.series : Dict[str, list] = {} # label value => [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock() # the checkpoint thread observes too
+
+    def observe(self, value:float, label_value:str=None):
+        with self._lock:
+            s = self.series.get(label_value)
+            if s is None:
+                s = [0] * (len(self.buckets) + 2)
+                self.series[label_value] = s
+
+            s[bisect.bisect_left(self.buckets, value)] += 1 # len(buckets) => +Inf
+            s[-1] += value
+
+    def render(self, lines:List[str]):
+        lines.append("# HELP {} {}".format(self.name, self.help))
+        lines.append("# TYPE {} histogram".format(self.name))
+        with self._lock:
+            series = {value: list(s) for value, s in self.series.items()}
+
+        for value, s in series.items():
+            prefix = "" if self.label is None else '{}="{}",'.format(self.label, value)
+            total = 0
+            for upper, n in zip(self.buckets, s):
+                total += n
+                lines.append('{}_bucket{{{}le="{}"}} {}'.format(self.name, prefix, upper, total))
+            total += s[len(self.buckets)]
+            lines.append('{}_bucket{{{}le="+Inf"}} {}'.format(self.name, prefix, total))
+            lines.append("{}_sum{} {}".format(self.name, _labels(self.label, value), s[-1]))
+            lines.append("{}_count{} {}".format(self.name, _labels(self.label, value), total))
+
+
+class _PhaseTimer:
+    __slots__ = ("histogram", "phase", "start")
+
+    def __init__(self, histogram:Histogram, phase:str):
+        self.histogram = histogram
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.phase)
+        return False
+
+
+class Metrics:
+    enabled = True
+
+    def __init__(self):
+        self.phase_seconds = Histogram("ah_phase_seconds", "Time spent in each phase of a round.", label="phase")
+        self.round_bids = Histogram("ah_round_bids", "Bids placed per round.", buckets=COUNT_BUCKETS)
+        self.payload_bytes = Histogram("ah_round_payload_bytes", "Size of an encoded round message (per variant and format).", buckets=BYTES_BUCKETS)
+
+        self.rounds = Counter("ah_rounds_total", "Rounds played.")
+        self.bids = Counter("ah_bids_total", "Bids received, by result.", label="result")
+        self.bid_messages_rejected = Counter("ah_bid_messages_rejected_total", "Bid messages rejected as a whole.")
+        self.bytes_sent = Counter("ah_round_bytes_sent_total", "Bytes of round messages sent to agents.")
+        self.send_timeouts = Counter("ah_send_timeouts_total", "Round sends that timed out (the agent was dropped).")
+
+        self.gauges : List[Gauge] = []
+
+    def phase(self, name:str) -> _PhaseTimer:
+        return _PhaseTimer(self.phase_seconds, name)
+
+    def observe_phase(self, name:str, seconds:float):
+        self.phase_seconds.observe(seconds, name)
+
+    def add_gauge(self, name:str, help:str, fn:Callable, label:str=None):
+        self.gauges.append(Gauge(name, help, fn, label=label))
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.phase_seconds, self.round_bids, self.payload_bytes, self.rounds, self.bids,
+                       self.bid_messages_rejected, self.bytes_sent, self.send_timeouts):
+            metric.render(lines)
+        for gauge in self.gauges:
+            gauge.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _NullMetric:
+    def observe(self, *args, **kwargs):
+        pass
+
+    def inc(self, *args, **kwargs):
+        pass
+
+
+class NullMetrics:
+    enabled = False
+
+    def __init__(self):
+        self._timer = _NullTimer()
+        null = _NullMetric()
+        self.phase_seconds = self.round_bids = self.payload_bytes = null
+        self.rounds = self.bids = self.bid_messages_rejected = self.bytes_sent = self.send_timeouts = null
+
+    def phase(self, name:str) -> _NullTimer:
+        return self._timer
+
+    def observe_phase(self, name:str, seconds:float):
+        pass
+
+    def add_gauge(self, name:str, help:str, fn:Callable, label:str=None):
+        pass
+
+    def render(self) -> str:
+        return ""
+
+
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,162 @@
+import os
+import asyncio
+import inspect
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List
+
+from dnd_auction_game.client import AuctionGameClient, DeltaView
+from dnd_auction_game.wire import FORMAT_JSON, decode, encode_json
+
+
+############################################################################################
+#
+# MultiAgentClient
+#   Runs many agents in one process: one event loop, one websocket per agent (the server
+#   sees normal agents, so it works with every server and the router).
+#
+#       agents = MultiAgentClient("localhost", port=8000)
+#       for k in range(200):
+#           agents.add_agent("tiny_{}".format(k), tiny_bid)
+#       agents.run()
+#
+#   The server sends every agent the same round message. SharedRounds decodes it once
+#   (and applies the protocol 2 delta once) for all the agents and encodes their log line
+#   once, so the agents get the SAME round dicts - a bid callback must not change them.
+#   Each agent gets a shallow copy with its own "current_agent". The agent ids get the
+#   index of the agent added, so they are unique within the process.
+#
+#   run(executor="thread"/"process", deadline=..) works as in AuctionGameClient.run, with
+#   one pool for all the agents.
+#
+############################################################################################
+
+
+class SharedRounds:
+    # the last `keep` rounds are kept built (round => [raw, round data, log line]) for agents
+    # that read a round late; the protocol 2 view is only moved forward, never back
+    def __init__(self, wire_format:str=FORMAT_JSON, keep:int=16):
+        self.wire_format = wire_format
+        self.keep = keep
+        self._view = DeltaView()
+        self._rounds : Dict[int, list] = {}
+        self._latest : int = None
+        self.n_decoded = 0
+
+    def read(self, raw) -> dict:
+        if self._latest is not None:
+            entry = self._rounds[self._latest]
+            if raw is entry[0] or raw == entry[0]:
+                return dict(entry[1])
+
+        message = decode(raw, self.wire_format)
+        r = message["round"]
+        entry = self._rounds.get(r)
+        if entry is None:
+            # (a known round: the other variant (full/delta) of it, or a late agent)
+            entry = [raw, self._build(message), None]
+            self.n_decoded += 1
+            self._rounds[r] = entry
+            if self._latest is None or r > self._latest:
+                self._latest = r
+                for old in [k for k in self._rounds if k <= r - self.keep]:
+                    del self._rounds[old]
+
+        return dict(entry[1])
+
+    def _build(self, message:dict) -> dict:
+        if "protocol" not in message:
+            return message
+        if self._latest is None or message["round"] > self._latest:
+            return self._view.apply(message)
+        if message["type"] == "full":
+            return DeltaView().apply(message)
+
+        # a delta older than the kept rounds: applied to a copy of the newest view (the
+        # states of the rounds in between are mixed in), the shared view is not touched
+        print("<agent more than {} rounds late, its states are not exact>".format(self.keep))
+        view = DeltaView()
+        view.states = {a_id: dict(s) for a_id, s in self._view.states.items()}
+        view.schedule = self._view.schedule
+        return view.apply(message)
+
+    def log_line(self, round_data:dict) -> str:
+        # the shared round encoded once, with the "current_agent" of this agent added at the end
+        entry = self._rounds.get(round_data["round"])
+        if entry is None:
+            return encode_json(round_data)
+        if entry[2] is None:
+            entry[2] = encode_json(entry[1])
+        return '{},"current_agent":{}}}'.format(entry[2][:-1], encode_json(round_data["current_agent"]))
+
+
+class MultiAgentClient:
+    def __init__(self, host:str, token:str="play123", player_id:str="<identifier>", port:int=8000, protocol:int=1, wire_format:str=FORMAT_JSON, game_id:str=None,
+                 save_logs:bool=True, log_dir:str="logs", log_compress:bool=False, log_max_bytes:int=0):
+        self.host = host
+        self.token = token
+        self.player_id = player_id
+        self.port = port
+        self.protocol = protocol
+        self.wire_format = wire_format
+        self.game_id = game_id
+
+        self.save_logs = save_logs
+        self.log_dir = log_dir
+        self.log_compress = log_compress
+        self.log_max_bytes = log_max_bytes
+
+        self.rounds = SharedRounds(wire_format)
+        self.clients : List[AuctionGameClient] = []
+        self.callbacks = []
+
+    def add_agent(self, agent_name:str, bid_callback) -> AuctionGameClient:
+        client = AuctionGameClient(self.host, agent_name, token=self.token, player_id=self.player_id, port=self.port, protocol=self.protocol,
+                                   wire_format=self.wire_format, game_id=self.game_id, save_logs=self.save_logs, log_dir=self.log_dir,
+                                   log_compress=self.log_compress, log_max_bytes=self.log_max_bytes, verbose=False)
+        # the machine id is the same for all the agents of this process, and the random local
+        # ids can clash with this many agents
+        client.agent_id = "{}_{}".format(client.agent_id, len(self.clients))
+
+        client.round_reader = self.rounds.read
+        client.log_encoder = self.rounds.log_line
+        self.clients.append(client)
+        self.callbacks.append(bid_callback)
+        return client
+
+    def run(self, executor:str=None, deadline:float=None, fallback:dict=None):
+        if not self.clients:
+            raise ValueError("no agents, use add_agent() first")
+
+        print("running {} agents, connecting to {}:{}".format(len(self.clients), self.host, self.port))
+        for client in self.clients:
+            client.open_log()
+        try:
+            asyncio.run(self._run(executor, deadline, fallback))
+        finally:
+            for client in self.clients:
+                client.close_log()
+
+        missed = sum(client.missed_rounds for client in self.clients)
+        print("<run done> {} agents, {} rounds decoded, {} missed rounds".format(len(self.clients), self.rounds.n_decoded, missed))
+
+    async def _run(self, executor, deadline:float, fallback:dict):
+        sync_callbacks = [cb for cb in self.callbacks if not inspect.iscoroutinefunction(cb)]
+
+        # one pool for all the agents instead of one per agent
+        pool = None
+        if executor is None and deadline is not None and sync_callbacks:
+            executor = "thread"
+        if executor == "thread":
+            pool = ThreadPoolExecutor(max_workers=len(sync_callbacks) or 1, thread_name_prefix="bid_callback")
+        elif executor == "process":
+            pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+        elif executor is not None:
+            pool = executor # a concurrent.futures.Executor of the caller
+
+        try:
+            await asyncio.gather(*[client._internal_run(cb, executor=None if inspect.iscoroutinefunction(cb) else pool,
+                                                        deadline=deadline, fallback=fallback)
+                                   for client, cb in zip(self.clients, self.callbacks)])
+        finally:
+            if pool is not None and pool is not executor:
+                pool.shutdown(wait=False, cancel_futures=True)
@@ -1,32 +1,39 @@
-import sys
 import random
+import argparse
 import asyncio
 import json
 import websockets
 
 
 class AuctionGameRunner:
-    def __init__(self, host:str, play_token:str, n_rounds=5, time_per_round:float=1.0, port:int=8000):
+    def __init__(self, host:str, play_token:str, n_rounds=5, time_per_round:float=1.0, port:int=8000, advance_when_all_bids:bool=False, game_id:str=None):
         self.host = host
         self.port = port
+        self.game_id = game_id # None: the default game of the server
         self.n_rounds = n_rounds
         self.play_token = play_token
         
         self.time_per_round = time_per_round
+        self.advance_when_all_bids = advance_when_all_bids  # start the next round as soon as every agent has bid
         
     def run(self):
         asyncio.run(self._internal_run())
         
         
     async def _internal_run(self):
-        connection_str = "ws://{}:{}/ws_run/{}".format(self.host, self.port, self.play_token)
+        if self.game_id is None:
+            connection_str = "ws://{}:{}/ws_run/{}".format(self.host, self.port, self.play_token)
+        else:
+            connection_str = "ws://{}:{}/ws_run/{}/{}".format(self.host, self.port, self.game_id, self.play_token)
         print("connecting to: {}".format(connection_str))
         
 
         async with websockets.connect(connection_str) as sock:
             print("<connected - starting game>")
 
-            game_info = {"num_rounds": self.n_rounds}
+            game_info = {"num_rounds": self.n_rounds,
+                         "time_per_round": self.time_per_round,
+                         "advance_when_all_bids": self.advance_when_all_bids}
             await sock.send(json.dumps(game_info))
 
             server_info_raw = await sock.recv()
@@ -40,17 +47,20 @@ class AuctionGameRunner:
         
 if __name__ == "__main__":    
     host = "localhost"
-    
-    n_rounds = 12
-    if len(sys.argv) >= 2:
-        n_rounds = int(sys.argv[1])
-
-    if len(sys.argv) >= 3:
-        play_token = sys.argv[2]
-    else:
-        play_token = "play123"
+
+    parser = argparse.ArgumentParser(description="Start a game on the server.")
+    parser.add_argument("n_rounds", type=int, nargs="?", default=12)
+    parser.add_argument("play_token", nargs="?", default="play123")
+    parser.add_argument("--time-per-round", type=float, default=1.0, help="seconds per round (the deadline when --advance-when-all-bids is set)")
+    parser.add_argument("--advance-when-all-bids", action="store_true", help="start the next round as soon as all connected agents have bid")
+    parser.add_argument("--game", default=None, help="id of the game to start, when the server runs several games")
+    args = parser.parse_args()
+    n_rounds = args.n_rounds
         
-    runner = AuctionGameRunner(host, n_rounds=n_rounds, play_token=play_token, port=8000)
+    runner = AuctionGameRunner(host, n_rounds=n_rounds, play_token=args.play_token, port=8000,
+                               time_per_round=args.time_per_round,
+                               advance_when_all_bids=args.advance_when_all_bids,
+                               game_id=args.game)
     print("Running the game for: {} rounds.".format(n_rounds))
     runner.run()
     
@@ -0,0 +1,235 @@
+import os
+import io
+import time
+import asyncio
+import pstats
+import cProfile
+import tracemalloc
+from typing import List
+
+
+############################################################################################
+#
+# RoundProfiler
+#   Profiles the next K rounds of a game while it runs: cProfile for the cpu and (optional)
+#   tracemalloc for the allocations. Armed with request(), from the admin endpoint
+#   '/admin/profile/{play_token}?game=..&rounds=K' or AH_PROFILE_ROUNDS for the first rounds
+#   of every game. Game.tick calls begin()/end() around the work of each round.
+#
+#   After the K-th round it writes (in an executor thread, off the event loop), next to the
+#   auction house logs:
+#     profile_<game>_<first>-<last>.prof        cProfile stats (snakeviz, pstats, ...)
+#     profile_<game>_<first>-<last>_cpu.txt     the top functions by cumulative and own time
+#     profile_<game>_<first>-<last>_memory.txt  peak traced memory per round and the lines
+#                                               that allocated the most during the K rounds
+#
+#   The profile covers the event loop thread while the round runs, so agent messages (and
+#   the rounds of other games) that run during the broadcast are in it too. cProfile and
+#   tracemalloc belong to the whole process: only one game is profiled at a time (the
+#   module level _owner), a second game that asks waits until the first has written its
+#   reports. Profiling never stops a game - errors are printed and the profile dropped.
+#
+############################################################################################
+
+
+_owner : "RoundProfiler" = None # the profiler that is profiling its rounds right now
+_tracemalloc_users = 0 # tracemalloc is stopped again when the last user is done, if we started it
+_started_tracemalloc = False
+
+
+def _acquire_tracemalloc():
+    global _tracemalloc_users, _started_tracemalloc
+    if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(10)
+        _started_tracemalloc = True
+    _tracemalloc_users += 1
+
+
+def _release_tracemalloc():
+    global _tracemalloc_users, _started_tracemalloc
+    _tracemalloc_users -= 1
+    if _tracemalloc_users == 0 and _started_tracemalloc:
+        _started_tracemalloc = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class RoundProfiler:
+    def __init__(self, name:str, directory:str="."):
+        self.name = name
+        self.directory = directory
+
+        self.rounds_left = 0
+        self.memory = False
+
+        self.profile : cProfile.Profile = None
+        self.tracing = False # holds a tracemalloc reference
+        self.memory_start : tracemalloc.Snapshot = None
+        self.first_round = None
+        self.last_round = None
+        self.round_peaks : List[tuple] = [] # (round, peak bytes)
+
+        self.reports : List[str] = [] # files written
+        self.writing : asyncio.Future = None # the reports being written
+
+    @property
+    def active(self) -> bool:
+        return self.rounds_left > 0 or self.profile is not None or self.writing is not None
+
+    def request(self, rounds:int, memory:bool=True) -> bool:
+        # False if this game is already being profiled
+        if self.active or rounds <= 0:
+            return False
+        self.rounds_left = rounds
+        self.memory = memory
+        return True
+
+    def begin(self, round_counter:int):
+        global _owner
+        if self.rounds_left <= 0 or self.writing is not None:
+            return
+        if _owner is not None and _owner is not self:
+            return # another game is being profiled, wait for it to finish
+
+        try:
+            if self.profile is None:
+                profile = cProfile.Profile()
+                profile.enable() # ValueError (3.12+) if a tool outside this module profiles
+                profile.disable()
+
+                _owner = self
+                self.profile = profile
+                self.first_round = round_counter
+                self.round_peaks = []
+                if self.memory:
+                    _acquire_tracemalloc()
+                    self.tracing = True
+                    self.memory_start = tracemalloc.take_snapshot()
+
+            self.last_round = round_counter
+            if self.tracing:
+                tracemalloc.reset_peak()
+            self.profile.enable()
+        except Exception as e:
+            print("could not profile game '{}': {}".format(self.name, e))
+            self._drop()
+
+    def end(self):
+        if self.profile is None:
+            return
+
+        try:
+            self.profile.disable()
+            if self.tracing:
+                self.round_peaks.append((self.last_round, tracemalloc.get_traced_memory()[1]))
+        except Exception as e:
+            print("could not profile game '{}': {}".format(self.name, e))
+            self._drop()
+            return
+
+        self.rounds_left -= 1
+        if self.rounds_left <= 0:
+            self.rounds_left = 0
+            self.finish()
+
+    def cancel(self):
+        if self.profile is not None:
+            try:
+                self.profile.disable()
+            except Exception:
+                pass
+        self.rounds_left = 0
+        self.finish()
+
+    def _drop(self):
+        # give up this profile without reports
+        self.rounds_left = 0
+        self.profile = None
+        self._release()
+
+    def _release(self):
+        global _owner
+        if self.tracing:
+            self.tracing = False
+            try:
+                _release_tracemalloc()
+            except Exception as e:
+                print("error stopping tracemalloc: {}".format(e))
+        if _owner is self:
+            _owner = None
+        self.memory_start = None
+
+    def finish(self):
+        # the reports are written in the default executor, the profiler (and tracemalloc) is
+        # released when they are done
+        profile = self.profile
+        self.profile = None
+        if profile is None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is None:
+            try:
+                self._write_reports(profile)
+            except Exception as e:
+                print("could not write the profile of game '{}': {}".format(self.name, e))
+            self._release()
+            return
+
+        self.writing = loop.run_in_executor(None, self._write_reports, profile)
+        self.writing.add_done_callback(self._reports_written)
+
+    def _reports_written(self, future:asyncio.Future):
+        self.writing = None
+        if not future.cancelled() and future.exception() is not None:
+            print("could not write the profile of game '{}': {}".format(self.name, future.exception()))
+        self._release()
+
+    def _write_reports(self, profile:cProfile.Profile):
+        snapshot = None
+        if self.tracing and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = os.path.join(self.directory, "profile_{}_{}-{}".format(self.name, self.first_round, self.last_round))
+        try:
+            profile.dump_stats(prefix + ".prof")
+            with open(prefix + "_cpu.txt", "w") as fp:
+                fp.write(self.cpu_report(profile))
+            self.reports = [prefix + ".prof", prefix + "_cpu.txt"]
+
+            if snapshot is not None:
+                with open(prefix + "_memory.txt", "w") as fp:
+                    fp.write(self.memory_report(snapshot))
+                self.reports.append(prefix + "_memory.txt")
+
+            print("profile of rounds {}-{} of game '{}': {}".format(self.first_round, self.last_round, self.name, prefix + ".prof"))
+        except OSError as e:
+            print("could not write the profile of game '{}': {}".format(self.name, e))
+
+    def cpu_report(self, profile:cProfile.Profile, top:int=40) -> str:
+        out = io.StringIO()
+        out.write("game '{}', rounds {}-{}, {}\n\n".format(self.name, self.first_round, self.last_round, time.strftime("%Y-%m-%d %H:%M:%S")))
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats("cumulative").print_stats(top)
+        stats.sort_stats("tottime").print_stats(top)
+        return out.getvalue()
+
+    def memory_report(self, snapshot:tracemalloc.Snapshot, top:int=30) -> str:
+        lines = ["game '{}', rounds {}-{}".format(self.name, self.first_round, self.last_round), "",
+                 "peak traced memory per round:"]
+        for r, peak in self.round_peaks:
+            lines.append("  round {:>6}: {:>10.1f} KiB".format(r, peak / 1024.0))
+
+        lines += ["", "top {} lines by allocated size during the rounds:".format(top)]
+        for stat in snapshot.compare_to(self.memory_start, "lineno")[:top]:
+            lines.append("  " + str(stat))
+
+        lines += ["", "top {} lines by traced size at the end:".format(top)]
+        for stat in snapshot.statistics("lineno")[:top]:
+            lines.append("  " + str(stat))
+        return "\n".join(lines) + "\n"
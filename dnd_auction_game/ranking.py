@@ -0,0 +1,58 @@
+import bisect
+from typing import List
+
+import numpy as np
+
+
+############################################################################################
+#
+# RankingIndex
+#   The agents sorted by points (most points first), kept sorted as the points change.
+#   Entries are (-points, slot), so agents with the same points keep the order they joined
+#   in - the same order as a stable sort of all agents by points.
+#   An update is two bisects on a flat list, reading the top K is a slice. When a large part
+#   of the agents change at once, the list is rebuilt with one numpy sort instead.
+#
+############################################################################################
+
+
+class RankingIndex:
+    def __init__(self):
+        self.entries : List[tuple] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, slot:int, points:int=0):
+        bisect.insort(self.entries, (-points, slot))
+
+    def update(self, slot:int, old_points:int, new_points:int):
+        if old_points == new_points:
+            return
+
+        k = bisect.bisect_left(self.entries, (-old_points, slot))
+        del self.entries[k]
+        bisect.insort(self.entries, (-new_points, slot))
+
+    def update_many(self, slots:List[int], old_points:List[int], new_points:List[int], all_points:np.ndarray):
+        # all_points: the points of every agent (indexed by slot), after the update
+        if len(slots) * 8 > len(self.entries):
+            self.rebuild(all_points)
+            return
+
+        for slot, old, new in zip(slots, old_points, new_points):
+            self.update(slot, old, new)
+
+    def rebuild(self, all_points:np.ndarray):
+        neg_points = -np.asarray(all_points, dtype=np.int64)
+        order = np.lexsort((np.arange(len(neg_points)), neg_points))
+        self.entries = list(zip(neg_points[order].tolist(), order.tolist()))
+
+    def position(self, slot:int, points:int) -> int:
+        # 0 for the leader
+        return bisect.bisect_left(self.entries, (-points, slot))
+
+    def top(self, limit:int=None, offset:int=0) -> List[int]:
+        # the slots from position offset, in ranking order
+        end = len(self.entries) if limit is None else offset + limit
+        return [slot for _, slot in self.entries[offset:end]]
@@ -0,0 +1,44 @@
+import asyncio
+
+
+############################################################################################
+#
+# RoundClock
+#   Decides when server_tick starts the next round.
+#   The round ends after time_per_round seconds, or (advance_when_all_bids=True) as soon
+#   as wake() is called because every connected agent has sent its bids - the period is
+#   then only the deadline for slow agents.
+#
+############################################################################################
+
+
+class RoundClock:
+    def __init__(self, time_per_round:float=1.0, advance_when_all_bids:bool=False):
+        self.time_per_round = time_per_round
+        self.advance_when_all_bids = advance_when_all_bids
+        self._event : asyncio.Event = None
+
+    def configure(self, time_per_round:float=1.0, advance_when_all_bids:bool=False):
+        if time_per_round <= 0:
+            raise ValueError("time_per_round must be positive, got: {}".format(time_per_round))
+
+        self.time_per_round = time_per_round
+        self.advance_when_all_bids = advance_when_all_bids
+
+    def _get_event(self) -> asyncio.Event:
+        # created lazily, so it belongs to the running loop
+        if self._event is None:
+            self._event = asyncio.Event()
+        return self._event
+
+    def wake(self):
+        self._get_event().set()
+
+    async def wait(self):
+        event = self._get_event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout=self.time_per_round)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            event.clear()
@@ -0,0 +1,346 @@
+import os
+import sys
+import zlib
+import time
+import json
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Tuple
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+
+import websockets
+from fastapi.responses import Response
+from fastapi import (
+    FastAPI,
+    Request,
+    WebSocket,
+)
+
+from dnd_auction_game.game_registry import DEFAULT_GAME
+
+
+############################################################################################
+#
+# router
+#   Runs the games in several worker processes behind one front door, so a big event uses
+#   all the cores of the box:
+#
+#   python -m dnd_auction_game.router --workers 4 --port 8000
+#
+#   Every worker is a normal server (server.py) listening on a unix socket. A game id
+#   always belongs to the same worker (crc32 of the id), the router only forwards: the
+#   websockets of the agents, the runner and the spectators are piped frame by frame
+#   (never decoded), the http pages are forwarded with the headers that matter for the
+#   ETag/304 api. '/api/games' lists the games of all the workers, '/metrics' merges the
+#   metrics of all the workers (every sample gets a worker="k" label).
+#
+#   Each worker writes its logs to <log dir>/worker_<k>, the checkpoints of a game are in
+#   the same place as without the router - keep the number of workers when restarting.
+#   All AH_* environment variables are passed on to the workers.
+#
+############################################################################################
+
+
+def shard(game_id:str, n_workers:int) -> int:
+    return zlib.crc32(game_id.encode("utf-8")) % n_workers
+
+
+class Workers:
+    def __init__(self, n_workers:int, socket_dir:str=None, log_dir:str="."):
+        if n_workers < 1:
+            raise ValueError("n_workers must be at least 1, got: {}".format(n_workers))
+
+        self.n_workers = n_workers
+        self.socket_dir = socket_dir # None: a temp folder, made by start()
+        self.log_dir = log_dir
+        self.sockets : List[str] = []
+        self.processes : List[subprocess.Popen] = []
+
+    def socket_for(self, game_id:str) -> str:
+        return self.sockets[shard(game_id, self.n_workers)]
+
+    def start(self, timeout:float=30.0):
+        if self.socket_dir is None:
+            self.socket_dir = tempfile.mkdtemp(prefix="dnd_auction_game_")
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self.sockets = [os.path.join(self.socket_dir, "worker_{}.sock".format(k)) for k in range(self.n_workers)]
+
+        default_owner = shard(DEFAULT_GAME, self.n_workers)
+        for k, path in enumerate(self.sockets):
+            if os.path.exists(path):
+                os.remove(path)
+
+            worker_log_dir = os.path.join(self.log_dir, "worker_{}".format(k))
+            os.makedirs(worker_log_dir, exist_ok=True)
+
+            env = dict(os.environ)
+            env["AH_LOG_DIR"] = worker_log_dir
+            env["AH_CREATE_DEFAULT_GAME"] = "1" if k == default_owner else "0"
+
+            cmd = [sys.executable, "-m", "uvicorn", "dnd_auction_game.server:app", "--uds", path, "--log-level", "warning"]
+            self.processes.append(subprocess.Popen(cmd, env=env))
+
+        self._wait_ready(timeout)
+        print("started {} workers, sockets in: '{}'".format(self.n_workers, self.socket_dir))
+
+    def _wait_ready(self, timeout:float):
+        deadline = time.monotonic() + timeout
+        for path, process in zip(self.sockets, self.processes):
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError("worker for '{}' exited with code {}".format(path, process.returncode))
+
+                try:
+                    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                        s.connect(path)
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError("worker for '{}' did not start in {}s".format(path, timeout))
+                    time.sleep(0.05)
+
+    def stop(self, timeout:float=10.0):
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+
+        for process in self.processes:
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+
+        for path in self.sockets:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# http headers passed through in each direction
+_REQUEST_HEADERS = ("if-none-match", "accept")
+_RESPONSE_HEADERS = ("etag", "cache-control", "content-type")
+
+
+async def http_get(socket_path:str, path:str, headers:Dict[str, str]=None) -> Tuple[int, Dict[str, str], bytes]:
+    # a minimal HTTP/1.1 GET over a unix socket: one request per connection
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    try:
+        lines = ["GET {} HTTP/1.1".format(path), "Host: worker", "Connection: close"]
+        for name, value in (headers or {}).items():
+            lines.append("{}: {}".format(name, value))
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        raw = await reader.read()
+    finally:
+        writer.close()
+
+    head, _, body = raw.partition(b"\r\n\r\n")
+    head_lines = head.decode("latin-1").split("\r\n")
+    status = int(head_lines[0].split(" ")[1])
+    response_headers = {}
+    chunked = False
+    for line in head_lines[1:]:
+        name, _, value = line.partition(":")
+        name = name.strip().lower()
+        response_headers[name] = value.strip()
+        if name == "transfer-encoding" and "chunked" in value:
+            chunked = True
+
+    if chunked:
+        body = _dechunk(body)
+    return status, response_headers, body
+
+
+def _dechunk(data:bytes) -> bytes:
+    out = []
+    while data:
+        size_line, _, data = data.partition(b"\r\n")
+        size = int(size_line.split(b";")[0], 16)
+        if size == 0:
+            break
+        out.append(data[:size])
+        data = data[size+2:]
+    return b"".join(out)
+
+
+n_workers = int(os.environ.get("AH_WORKERS", os.cpu_count() or 1))
+workers = Workers(n_workers, socket_dir=os.environ.get("AH_SOCKET_DIR"), log_dir=os.environ.get("AH_LOG_DIR", "."))
+
+
+@asynccontextmanager
+async def start_workers(app: FastAPI):
+    workers.start()
+    yield
+    workers.stop()
+
+
+app = FastAPI(lifespan=start_workers)
+
+
+async def pipe_websocket(websocket: WebSocket, socket_path:str, path:str):
+    # connect to the worker first, so a refused connection is refused for the client too
+    try:
+        upstream = await websockets.unix_connect(socket_path, "ws://worker" + path, max_size=None)
+    except Exception:
+        return
+
+    await websocket.accept()
+
+    async def client_to_worker():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("text") is not None:
+                await upstream.send(message["text"])
+            elif message.get("bytes") is not None:
+                await upstream.send(message["bytes"])
+
+    async def worker_to_client():
+        async for data in upstream:
+            if isinstance(data, bytes):
+                await websocket.send_bytes(data)
+            else:
+                await websocket.send_text(data)
+
+    tasks = [asyncio.create_task(client_to_worker()), asyncio.create_task(worker_to_client())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        await upstream.close()
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+
+@app.websocket("/ws/{token}")
+async def route_client(websocket: WebSocket, token: str):
+    await pipe_websocket(websocket, workers.socket_for(DEFAULT_GAME), "/ws/{}".format(token))
+
+
+@app.websocket("/ws/{game_id}/{token}")
+async def route_game_client(websocket: WebSocket, game_id: str, token: str):
+    await pipe_websocket(websocket, workers.socket_for(game_id), "/ws/{}/{}".format(game_id, token))
+
+
+@app.websocket("/ws_run/{play_token}")
+async def route_runner(websocket: WebSocket, play_token: str):
+    await pipe_websocket(websocket, workers.socket_for(DEFAULT_GAME), "/ws_run/{}".format(play_token))
+
+
+@app.websocket("/ws_run/{game_id}/{play_token}")
+async def route_game_runner(websocket: WebSocket, game_id: str, play_token: str):
+    await pipe_websocket(websocket, workers.socket_for(game_id), "/ws_run/{}/{}".format(game_id, play_token))
+
+
+@app.websocket("/ws_spectate")
+async def route_spectator(websocket: WebSocket, game: str = DEFAULT_GAME):
+    await pipe_websocket(websocket, workers.socket_for(game), "/ws_spectate?" + urlencode({"game": game}))
+
+
+@app.get("/api/games")
+async def get_games():
+    results = await asyncio.gather(*[http_get(path, "/api/games") for path in workers.sockets], return_exceptions=True)
+
+    games = []
+    max_games = 0
+    for k, result in enumerate(results):
+        if isinstance(result, Exception) or result[0] != 200:
+            continue
+        data = json.loads(result[2])
+        max_games += data["max_games"]
+        for g in data["games"]:
+            g["worker"] = k
+            games.append(g)
+
+    return {"workers": workers.n_workers, "max_games": max_games, "games": games}
+
+
+def merge_metrics(texts:List[Tuple[int, str]]) -> str:
+    # (worker, prometheus text) -> one text: HELP/TYPE once per metric, the samples of all
+    # the workers below it with a worker label
+    families : Dict[str, dict] = {}
+    for k, text in texts:
+        family = families.setdefault("", {"head": [], "samples": []})
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    family = families.setdefault(parts[2], {"head": [], "samples": []})
+                    if not any(h.split(" ", 2)[1] == parts[1] for h in family["head"]):
+                        family["head"].append(line)
+                continue
+
+            end = min(i for i in (line.find("{"), line.find(" "), len(line)) if i >= 0)
+            if line[end:end+1] == "{":
+                line = '{}{{worker="{}",{}'.format(line[:end], k, line[end+1:])
+            else:
+                line = '{}{{worker="{}"}}{}'.format(line[:end], k, line[end:])
+            family["samples"].append(line)
+
+    lines = []
+    for family in families.values():
+        lines += family["head"] + family["samples"]
+    return "\n".join(lines) + "\n"
+
+
+@app.get("/metrics")
+async def get_metrics():
+    results = await asyncio.gather(*[http_get(path, "/metrics") for path in workers.sockets], return_exceptions=True)
+
+    texts = []
+    for k, result in enumerate(results):
+        if isinstance(result, Exception) or result[0] != 200:
+            continue
+        texts.append((k, result[2].decode("utf-8")))
+
+    if not texts:
+        return Response(status_code=404)
+    return Response(content=merge_metrics(texts), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/{path:path}")
+async def route_get(request: Request, path: str):
+    game = request.query_params.get("game", DEFAULT_GAME)
+    target = "/" + path
+    if request.url.query:
+        target += "?" + request.url.query
+
+    headers = {name: request.headers[name] for name in _REQUEST_HEADERS if name in request.headers}
+    try:
+        status, response_headers, body = await http_get(workers.socket_for(game), target, headers)
+    except OSError:
+        return Response(status_code=502)
+
+    headers = {name: response_headers[name] for name in _RESPONSE_HEADERS if name in response_headers}
+    media_type = headers.pop("content-type", None)
+    return Response(content=body, status_code=status, headers=headers, media_type=media_type)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the games in several worker processes behind one port.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes (default: number of cpus)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket-dir", default=None, help="folder for the unix sockets of the workers (default: a temp folder)")
+    args = parser.parse_args()
+
+    os.environ["AH_WORKERS"] = str(args.workers)
+    if args.socket_dir is not None:
+        os.environ["AH_SOCKET_DIR"] = args.socket_dir
+
+    uvicorn.run("dnd_auction_game.router:app", host=args.host, port=args.port, log_level="warning")
@@ -9,72 +9,93 @@ import json
 from contextlib import asynccontextmanager
 
 
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi import (
     FastAPI,
+    HTTPException,
+    Query,
+    Request,
     WebSocket,
     WebSocketDisconnect,
 )
 
-from dnd_auction_game.connection_manager import ConnectionManager
 from dnd_auction_game.auction_house import AuctionHouse
-from dnd_auction_game.leadboard import generate_leadboard   
+from dnd_auction_game.checkpoint import Checkpointer
+from dnd_auction_game.wire import FORMAT_JSON, FORMAT_MSGPACK, format_available
+from dnd_auction_game.bid_intake import BidRejected, read_bids
+from dnd_auction_game.leadboard import standings_delta
+from dnd_auction_game.game_registry import DEFAULT_GAME, Game, GameRegistry
+from dnd_auction_game.metrics import Metrics, NULL_METRICS
 
 
 game_token = os.environ.get("AH_GAME_TOKEN", "play123")
 play_token = os.environ.get("AH_PLAY_TOKEN", "play123")
 
-save_all_states = os.environ.get("AH_SAVE_ALL_STATES", 0)
-
-import pickle
-
+save_all_states = int(os.environ.get("AH_SAVE_ALL_STATES", 0))
+checkpoint_dir = os.environ.get("AH_CHECKPOINT_DIR", "checkpoint")
+checkpoint_every = int(os.environ.get("AH_CHECKPOINT_EVERY", 10)) # rounds between snapshots
+send_timeout = float(os.environ.get("AH_SEND_TIMEOUT", 1.0))
+log_format = os.environ.get("AH_LOG_FORMAT", "jsonln") # jsonln, columnar or both
+log_dir = os.environ.get("AH_LOG_DIR", ".")
+max_bid_bytes = int(os.environ.get("AH_MAX_BID_BYTES", 1 << 20)) # larger bid messages are rejected without decoding
+metrics_enabled = int(os.environ.get("AH_METRICS", 1)) # 0: no instrumentation and no /metrics
+profile_rounds = int(os.environ.get("AH_PROFILE_ROUNDS", 0)) # profile the first rounds of every game (see profiler.py)
+max_games = int(os.environ.get("AH_MAX_GAMES", 64))
+game_idle_timeout = float(os.environ.get("AH_GAME_IDLE_TIMEOUT", 600)) # seconds before an idle game is removed
+create_default_game = int(os.environ.get("AH_CREATE_DEFAULT_GAME", 1)) # 0 for the workers behind router.py that do not own it
 
 if save_all_states > 0:
     print("save all states - ACTIVATED")
 
-state_file = "state.pkl"
-if save_all_states > 0 and os.path.isfile(state_file):
-    print("read state from file.")
-    with open(state_file, "rb") as fp:
-        auction_house = pickle.load(fp)
-else:
-    print("starting raw house")
-    auction_house = AuctionHouse(game_token=game_token, play_token=play_token, save_logs=True)
+metrics = Metrics() if metrics_enabled else NULL_METRICS
 
-connection_manager = ConnectionManager()
 
-async def server_tick():
-    while True:
-        
-        if auction_house.is_active:
+def make_game(game_id:str) -> Game:
+    # the default game checkpoints to AH_CHECKPOINT_DIR, the other games to a folder per game in it
+    auction_house = None
+    checkpointer = None
+    if save_all_states > 0:
+        directory = checkpoint_dir if game_id == DEFAULT_GAME else os.path.join(checkpoint_dir, "games", game_id)
+        checkpointer = Checkpointer(directory, every=checkpoint_every, metrics=metrics)
+        auction_house = checkpointer.restore()
+        if auction_house is not None:
+            print("read state of game '{}' from checkpoint, at round {}.".format(game_id, auction_house.round_counter))
 
-            auction_house.process_all_bids()
-            try:
-                round_data = auction_house.prepare_auction()
-            except Exception as e:
-                print("error in prepare_auction")
-                print(e)
+    if auction_house is None:
+        print("starting raw house for game '{}'".format(game_id))
+        auction_house = AuctionHouse(game_token=game_token, play_token=play_token, save_logs=True, log_format=log_format, log_dir=log_dir)
 
-            await connection_manager.broadcast(round_data)
+    if checkpointer is not None:
+        checkpointer.attach(auction_house)
 
-            if auction_house.round_counter >= auction_house.num_rounds_in_game:
-                auction_house.is_active = False
-                auction_house.is_done = True
+    return Game(game_id, auction_house, checkpointer=checkpointer, send_timeout=send_timeout, metrics=metrics,
+                profile_rounds=profile_rounds)
 
-                await connection_manager.disconnect_all()                
-            
-            if save_all_states > 0:
-                with open(state_file, "wb") as fp:
-                    pickle.dump(auction_house, fp, protocol=pickle.HIGHEST_PROTOCOL)
 
-        await asyncio.sleep(1.0)
+games = GameRegistry(make_game, max_games=max_games, idle_timeout=game_idle_timeout)
 
+metrics.add_gauge("ah_games", "Games in this server.", lambda: len(games))
+metrics.add_gauge("ah_connected_agents", "Connected agent sockets.",
+                  lambda: sum(len(g.connection_manager.active_connections) for g in games.games.values()))
+metrics.add_gauge("ah_connected_spectators", "Connected spectator sockets.",
+                  lambda: sum(len(g.spectators.active_connections) for g in games.games.values()))
 
 
 @asynccontextmanager
 async def start_app_background_tasks(app: FastAPI):
-    task = asyncio.create_task(server_tick())
+    if create_default_game:
+        games.get_or_create(DEFAULT_GAME)
+    gc_task = asyncio.create_task(games.run_gc(interval=min(30.0, max(1.0, game_idle_timeout / 2))))
     yield
+    gc_task.cancel()
+    await games.close_all()
+
+
+def get_game(game_id:str) -> Game:
+    game = games.get(game_id)
+    if game is None:
+        raise HTTPException(status_code=404, detail="no game: '{}'".format(game_id))
+    return game
 
 
 app = FastAPI(lifespan=start_app_background_tasks)
@@ -82,11 +103,27 @@ app = FastAPI(lifespan=start_app_background_tasks)
 
 @app.websocket("/ws/{token}")
 async def websocket_endpoint_client(websocket: WebSocket, token: str):
-    
+    await play_agent(websocket, DEFAULT_GAME, token)
 
-    if token != auction_house.game_token:
+
+@app.websocket("/ws/{game_id}/{token}")
+async def websocket_endpoint_game_client(websocket: WebSocket, game_id: str, token: str):
+    await play_agent(websocket, game_id, token)
+
+
+async def play_agent(websocket: WebSocket, game_id: str, token: str):
+    game = games.get(game_id)
+    if game is None and token == game_token:
+        game = games.get_or_create(game_id)
+
+    if game is None or token != game.auction_house.game_token:
         return
 
+    game.touch()
+    auction_house = game.auction_house
+    connection_manager = game.connection_manager
+    round_clock = game.round_clock
+
     if auction_house.is_done:
         auction_house.reset()
 
@@ -101,6 +138,18 @@ async def websocket_endpoint_client(websocket: WebSocket, token: str):
         if len(agent_info["player_id"]) < 1:
             await websocket.close()
             return
+
+        protocol = int(agent_info.get("protocol", 1))
+        send_ack = bool(agent_info.get("ack", False)) # answer every bid message with the number of bids placed/rejected
+        if protocol not in (1, 2):
+            await websocket.close()
+            return
+
+        wire_format = agent_info.get("format", FORMAT_JSON)
+        if not format_available(wire_format):
+            print("agent: {} asked for an unsupported format: '{}'".format(agent_info["a_id"], wire_format))
+            await websocket.close()
+            return
         
     except WebSocketDisconnect:
         return
@@ -109,15 +158,45 @@ async def websocket_endpoint_client(websocket: WebSocket, token: str):
         return
     
     try:        
-        await connection_manager.add_connection(websocket)
+        await connection_manager.add_connection(websocket, name=agent_info["name"], a_id=agent_info["a_id"], protocol=protocol, wire_format=wire_format)
         auction_house.add_agent(agent_info["name"], agent_info["a_id"], agent_info["player_id"])
         a_id = agent_info["a_id"]
         
+        info = connection_manager.info[websocket]
+        
         while auction_house.is_done is False:
-            bids = await websocket.receive_json()
-                        
-            for auction_id, gold in bids.items():
-                auction_house.register_bid(a_id, auction_id, gold)       
+            if wire_format == FORMAT_MSGPACK:
+                data = await websocket.receive_bytes()
+            else:
+                data = await websocket.receive_text()
+
+            try:
+                bids, n_rejected = read_bids(data, wire_format, auction_house.current_auctions, max_bid_bytes)
+            except BidRejected as e:
+                metrics.bid_messages_rejected.inc()
+                info.messages_rejected += 1
+                if info.messages_rejected <= 3:
+                    print("agent: {} - bids rejected: {}".format(a_id, e))
+                bids, n_rejected = [], 0
+
+            n_placed = auction_house.register_bids(a_id, bids)
+            info.record_bids(n_placed, n_rejected + len(bids) - n_placed)
+            metrics.bids.inc(n_placed, "placed")
+            metrics.bids.inc(n_rejected + len(bids) - n_placed, "rejected")
+
+            info.bid_messages += 1
+            if info.bid_messages == info.rounds_sent:
+                auction_house.submitted.add(a_id)
+                if round_clock.advance_when_all_bids and auction_house.is_active:
+                    # submitted can hold agents that have disconnected, so the cheap check is only a first filter
+                    submitted = auction_house.submitted
+                    if len(submitted) >= len(connection_manager.active_connections) and \
+                            all(i.a_id in submitted for i in connection_manager.info.values()):
+                        round_clock.wake()
+
+            if send_ack:
+                await connection_manager.send_message({"type": "ack", "round": auction_house.round_counter - 1,
+                                                       "placed": n_placed, "rejected": n_rejected + len(bids) - n_placed}, websocket)
 
         await websocket.close()
             
@@ -134,12 +213,33 @@ async def websocket_endpoint_client(websocket: WebSocket, token: str):
 
 @app.websocket("/ws_run/{play_token}")
 async def websocket_endpoint_runner(websocket: WebSocket, play_token: str):
+    await run_game(websocket, DEFAULT_GAME, play_token)
+
+
+@app.websocket("/ws_run/{game_id}/{play_token}")
+async def websocket_endpoint_game_runner(websocket: WebSocket, game_id: str, play_token: str):
+    await run_game(websocket, game_id, play_token)
+
+
+async def run_game(websocket: WebSocket, game_id: str, token: str):
     
-    print("websocket_endpoint_runner - PLAY TOKEN:", play_token)
+    print("websocket_endpoint_runner - GAME: {}, PLAY TOKEN: {}".format(game_id, token))
+
+    game = games.get(game_id)
+    if game is None and token == play_token:
+        game = games.get_or_create(game_id)
 
-    if play_token != auction_house.play_token:
+    if game is None:
+        print("no game: '{}'".format(game_id))
+        return
+
+    if token != game.auction_house.play_token:
         print("wrong play token")
         return
+
+    game.touch()
+    auction_house = game.auction_house
+    round_clock = game.round_clock
     
     if auction_house.is_done:
         print("starting new game")
@@ -149,13 +249,30 @@ async def websocket_endpoint_runner(websocket: WebSocket, play_token: str):
         await websocket.accept()
 
         game_info = await websocket.receive_json()
+
+        # everything is checked before the game is changed
+        try:
+            num_rounds = int(game_info["num_rounds"])
+            time_per_round = float(game_info.get("time_per_round", 1.0))
+            advance_when_all_bids = bool(game_info.get("advance_when_all_bids", False))
+            if num_rounds < 1:
+                raise ValueError("num_rounds must be at least 1, got: {}".format(num_rounds))
+            if not time_per_round > 0:
+                raise ValueError("time_per_round must be positive, got: {}".format(time_per_round))
+        except (KeyError, TypeError, ValueError) as e:
+            print("game not started, bad game info: {}".format(e))
+            await websocket.close()
+            return
+
+        round_clock.configure(time_per_round=time_per_round, advance_when_all_bids=advance_when_all_bids)
         #auction_house.num_rounds_in_game = int(game_info["num_rounds"])
-        auction_house.set_num_rounds(int(game_info["num_rounds"]))
-        print("starting game with {} rounds".format(auction_house.num_rounds_in_game))
+        auction_house.set_num_rounds(num_rounds)
+        print("starting game '{}' with {} rounds, {:.3f}s per round".format(game_id, auction_house.num_rounds_in_game, round_clock.time_per_round))
 
         game_info = {
+            "game_id": game_id,
             "game_token": auction_house.game_token,
-            "num_players": len(auction_house.agents),
+            "num_players": len(auction_house.store),
         }
 
         await websocket.send_json(game_info)        
@@ -165,7 +282,8 @@ async def websocket_endpoint_runner(websocket: WebSocket, play_token: str):
         return
 
     
-    auction_house.is_active = True
+    auction_house.start(time_per_round=time_per_round, advance_when_all_bids=advance_when_all_bids)
+    round_clock.wake()
     print("<started game>")
 
     try:
@@ -175,38 +293,95 @@ async def websocket_endpoint_runner(websocket: WebSocket, play_token: str):
         
 
 @app.get("/")
-async def get():    
-    leadboard = []
-    for a_id, info in auction_house.agents.items():
-        name = auction_house.names[a_id]        
-        leadboard.append([name, info["points"], info["gold"]])
-
-    all_players = []
-    leadboard.sort(key=lambda x:x[1], reverse=True)
-    n_players = max(len(leadboard), 1)
-    for k, (name, points, gold) in enumerate(leadboard):
-        rank = (n_players - k) / n_players
-
-        grade = "F"
-
-        if points > 10:
-
-            if rank > 0.89:
-                grade = "A"
-            elif rank > 0.75:
-                grade = "B"
-            elif rank > 0.55:
-                grade = "C"
-            elif rank > 0.35:
-                grade = "D"
-            else:
-                grade = "E"
+async def get(top: int = None, game: str = DEFAULT_GAME):    
+    if top is not None and top < 1:
+        top = None
+    g = get_game(game)
+    return HTMLResponse(g.leadboard_cache.get_html(g.auction_house, top=top))
+
+
+@app.websocket("/ws_spectate")
+async def websocket_endpoint_spectator(websocket: WebSocket, game: str = DEFAULT_GAME):
+    # pushes the standings once when connecting, then the changed rows after every round
+    g = games.get(game)
+    if g is None:
+        return
+
+    try:
+        await websocket.accept()
+        await g.spectators.add_connection(websocket)
+        players = standings_delta([], g.leadboard_cache.get_standings(g.auction_house))
+        await g.spectators.send_message(g.leadboard_message("full", players), websocket)
+
+        while True:
+            await websocket.receive_text() # nothing is expected, this only notices the disconnect
+
+    except WebSocketDisconnect:
+        g.spectators.disconnect(websocket)
+
+    except:
+        g.spectators.disconnect(websocket)
+
+
+@app.get("/api/games")
+async def get_games():
+    return {"max_games": games.max_games, "games": games.summary()}
+
+
+@app.get("/api/connections")
+async def get_connections(game: str = DEFAULT_GAME):
+    # send latency per connected agent, slowest first
+    g = get_game(game)
+    return {"round": g.auction_house.round_counter,
+            "send_timeout": g.connection_manager.send_timeout,
+            "connections": g.connection_manager.latency_report(),
+            "n_dropped": g.connection_manager.n_dropped,
+            "dropped": list(g.connection_manager.dropped)}
+
+
+def api_response(request: Request, etag: str, body: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/standings")
+async def get_standings(request: Request, offset: int = 0, limit: int = 100, game: str = DEFAULT_GAME):
+    g = get_game(game)
+    etag, body = g.api_cache.standings(g.auction_house, offset=offset, limit=limit)
+    return api_response(request, etag, body)
+
+
+@app.get("/api/round")
+async def get_round(request: Request, game: str = DEFAULT_GAME):
+    g = get_game(game)
+    etag, body = g.api_cache.round_info(g.auction_house)
+    return api_response(request, etag, body)
+
+
+@app.get("/api/history")
+async def get_history(request: Request, from_round: int = Query(0, alias="from"), limit: int = 100, game: str = DEFAULT_GAME):
+    g = get_game(game)
+    etag, body = g.api_cache.history_page(g.auction_house, from_round=from_round, limit=limit)
+    return api_response(request, etag, body)
 
-        all_players.append({'grade': grade, 'name': name, 'gold': gold, 'points': points})
 
+@app.get("/metrics")
+async def get_metrics():
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="metrics are turned off (AH_METRICS=0)")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
 
-    return HTMLResponse(generate_leadboard(all_players,
-                                           auction_house.round_counter,
-                                           auction_house.is_done))
 
+@app.get("/admin/profile/{token}")
+async def start_profile(token: str, rounds: int = 10, memory: int = 1, game: str = DEFAULT_GAME):
+    # profile the next `rounds` rounds of the game, the reports are written next to the logs
+    g = get_game(game)
+    if token != g.auction_house.play_token:
+        raise HTTPException(status_code=403, detail="wrong token")
 
+    profiler = g.profiler
+    if not profiler.request(rounds, memory=bool(memory)):
+        return {"game_id": game, "started": False, "rounds_left": profiler.rounds_left, "reports": profiler.reports}
+    return {"game_id": game, "started": True, "rounds": rounds, "memory": bool(memory), "directory": os.path.abspath(profiler.directory)}
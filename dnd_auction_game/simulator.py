@@ -0,0 +1,108 @@
+import copy
+from typing import Callable, Dict, List, Union
+
+from dnd_auction_game.auction_house import AuctionHouse
+from dnd_auction_game.bid_intake import BidRejected, check_bids
+
+
+############################################################################################
+#
+# Simulator
+#   Runs a full game in-process, without the websocket server.
+#   Each agent is a make_bid style callable:
+#       make_bid(agent_id, current_round, states, auctions, prev_auctions, bank_state) -> dict
+#   There is no networking and no sleeping between rounds, so the game runs as fast as
+#   the agents can bid.
+#
+############################################################################################
+
+
+class Simulator:
+    def __init__(self, agents:Union[List[Callable], Dict[str, Callable]], num_rounds:int=10, seed:int=None, vectorized:bool=True, verbose:bool=False):
+        if isinstance(agents, dict):
+            agents = list(agents.items())
+        else:
+            agents = [(getattr(cb, "__name__", "agent"), cb) for cb in agents]
+
+        if len(agents) < 1:
+            raise ValueError("Simulator needs at least one agent")
+
+        self.agents = agents
+        self.num_rounds = num_rounds
+        self.seed = seed
+        self.vectorized = vectorized
+        self.verbose = verbose
+
+        self.auction_house : AuctionHouse = None
+
+    def _new_auction_house(self) -> AuctionHouse:
+        return AuctionHouse(game_token="simulator", play_token="simulator", save_logs=False, seed=self.seed, vectorized=self.vectorized)
+
+    def run(self) -> List[dict]:
+        house = self._new_auction_house()
+        self.auction_house = house
+
+        callbacks = {}
+        for k, (name, cb) in enumerate(self.agents):
+            a_id = "sim_agent_{}".format(k)
+            house.add_agent(name, a_id, "simulator")
+            callbacks[a_id] = cb
+
+        house.set_num_rounds(self.num_rounds)
+        house.start(time_per_round=0.0)
+
+        # same order as server_tick: settle the last round, start the next one, collect bids.
+        while house.round_counter < house.num_rounds_in_game:
+            house.process_all_bids()
+            round_data = house.prepare_auction()
+
+            if self.verbose:
+                print("round: {}  auctions: {}".format(round_data["round"], len(round_data["auctions"])))
+
+            # the server disconnects everyone right after the last round is sent, so bids
+            # for the final round are never processed.
+            if house.round_counter >= house.num_rounds_in_game:
+                break
+
+            self._collect_bids(house, callbacks, round_data)
+
+        house.finish()
+
+        return self.standings()
+
+    def _collect_bids(self, house:AuctionHouse, callbacks:Dict[str, Callable], round_data:dict):
+        # every agent gets its own deep copy of the round, like the message each agent decodes on
+        # the server, so an agent that changes it changes neither the house nor the other agents.
+        bank_state = {}
+        bank_state["gold_income_per_round"] = round_data["reminder_gold_income"]
+        bank_state["bank_interest_per_round"] = round_data["reminder_bank_interest"]
+        bank_state["bank_limit_per_round"] = round_data["reminder_bank_limit"]
+
+        current_round = round_data["round"]
+        view = (round_data["states"], round_data["auctions"], round_data["prev_auctions"], bank_state)
+
+        for a_id, cb in callbacks.items():
+            states, auctions, prev_auctions, agent_bank_state = copy.deepcopy(view)
+            bids = cb(a_id, current_round, states, auctions, prev_auctions, agent_bank_state)
+            if not bids:
+                continue
+
+            try:
+                valid, _ = check_bids(bids, house.current_auctions)
+            except BidRejected as e:
+                if self.verbose:
+                    print("agent: {} - bids rejected: {}".format(a_id, e))
+                continue
+            house.register_bids(a_id, valid)
+
+    def standings(self) -> List[dict]:
+        house = self.auction_house
+        if house is None:
+            return []
+
+        out = []
+        for slot in house.ranking.top():
+            a_id = house.store.ids[slot]
+            out.append({"a_id": a_id, "name": house.names[a_id], "points": int(house.store.points[slot]), "gold": int(house.store.gold[slot])})
+
+        return out
@@ -0,0 +1,185 @@
+import sys
+import os
+import math
+import random
+import argparse
+import importlib
+import itertools
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Tuple
+
+from dnd_auction_game.simulator import Simulator
+
+
+############################################################################################
+#
+# tournament
+#   Runs many seeded games in-process (see Simulator) spread over a process pool and
+#   aggregates the results into one leadboard.
+#
+#   Agents are given as import specs so they can be loaded inside the worker processes:
+#       module:function             ex: agent_tiny_bid:tiny_bid
+#       module:Class.method         ex: agent_random_walk:RandomWalkAgent.random_walk
+#   A class is created (with no arguments) once per game, so every game starts fresh.
+#
+#   python -m dnd_auction_game.tournament agent_tiny_bid:tiny_bid agent_random_walk:RandomWalkAgent.random_walk --games 100
+#
+############################################################################################
+
+
+def load_agent(spec:str) -> Callable:
+    if ":" not in spec:
+        raise ValueError("Agent spec must be on the form 'module:function' or 'module:Class.method', got: '{}'".format(spec))
+
+    module_name, attr = spec.split(":", 1)
+    obj = importlib.import_module(module_name)
+
+    parts = attr.split(".")
+    for k, part in enumerate(parts):
+        obj = getattr(obj, part)
+        if isinstance(obj, type) and k < len(parts)-1:
+            obj = obj()
+
+    if not callable(obj):
+        raise ValueError("Agent spec '{}' is not callable".format(spec))
+
+    return obj
+
+
+def _init_worker(paths:List[str]):
+    for path in reversed(paths):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def agent_seed(seed:int) -> int:
+    # the house is seeded with `seed`, the agents get a seed derived from it, so their random
+    # numbers are not the same stream as the schedule and auctions of the game
+    return random.Random("agents:{}".format(seed)).getrandbits(64)
+
+
+def _seed_agents(seed:int):
+    # agents use the global random (and numpy) modules, seed them so a game is reproducible.
+    seed = agent_seed(seed)
+    random.seed(seed)
+    try:
+        import numpy as np
+        np.random.seed(seed % (2**32))
+    except ImportError:
+        pass
+
+
+def play_game(game:Tuple[int, int, List[str], int]) -> List[dict]:
+    game_index, seed, specs, num_rounds = game
+
+    _seed_agents(seed)
+    agents = {}
+    for k, spec in enumerate(specs):
+        agents["{}#{}".format(spec, k)] = load_agent(spec)
+
+    sim = Simulator(agents, num_rounds=num_rounds, seed=seed)
+    standings = sim.run()
+
+    n_players = len(standings)
+    results = []
+    for rank, s in enumerate(standings):
+        results.append({
+            "game": game_index,
+            "seed": seed,
+            "spec": s["name"].rsplit("#", 1)[0],
+            "points": s["points"],
+            "gold": s["gold"],
+            "rank": rank + 1,
+            "n_players": n_players,
+        })
+
+    return results
+
+
+def make_schedule(specs:List[str], n_games:int, num_rounds:int, seed:int=0, players_per_game:int=None) -> List[tuple]:
+    if players_per_game is None or players_per_game >= len(specs):
+        lineups = [list(specs)]
+    else:
+        lineups = [list(c) for c in itertools.combinations(specs, players_per_game)]
+
+    schedule = []
+    for lineup in lineups:
+        for _ in range(n_games):
+            game_index = len(schedule)
+            schedule.append((game_index, seed + game_index, lineup, num_rounds))
+
+    return schedule
+
+
+def aggregate(results:List[dict]) -> List[dict]:
+    per_spec = {}
+    for r in results:
+        per_spec.setdefault(r["spec"], []).append(r)
+
+    leadboard = []
+    for spec, rs in per_spec.items():
+        points = [r["points"] for r in rs]
+        n = len(points)
+        mean = statistics.fmean(points)
+        std = statistics.stdev(points) if n > 1 else 0.0
+        ci95 = 1.96 * std / math.sqrt(n)
+
+        leadboard.append({
+            "spec": spec,
+            "games": n,
+            "mean_points": mean,
+            "std_points": std,
+            "ci95_low": mean - ci95,
+            "ci95_high": mean + ci95,
+            "mean_rank": statistics.fmean(r["rank"] for r in rs),
+            "wins": sum(1 for r in rs if r["rank"] == 1),
+        })
+
+    leadboard.sort(key=lambda x:x["mean_points"], reverse=True)
+    return leadboard
+
+
+def run_tournament(specs:List[str], n_games:int=10, num_rounds:int=10, seed:int=0,
+                   players_per_game:int=None, n_workers:int=None, paths:List[str]=None) -> List[dict]:
+    if paths is None:
+        paths = [os.getcwd()]
+
+    schedule = make_schedule(specs, n_games, num_rounds, seed=seed, players_per_game=players_per_game)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(paths,)) as executor:
+        for game_results in executor.map(play_game, schedule, chunksize=max(1, len(schedule) // 64)):
+            results.extend(game_results)
+
+    return aggregate(results)
+
+
+def print_leadboard(leadboard:List[dict]):
+    print("{:>4}  {:<50} {:>6} {:>12} {:>25} {:>9} {:>6}".format("#", "agent", "games", "mean points", "95% CI", "mean rank", "wins"))
+    for k, row in enumerate(leadboard):
+        ci = "[{:.1f}, {:.1f}]".format(row["ci95_low"], row["ci95_high"])
+        print("{:>4}  {:<50} {:>6} {:>12.1f} {:>25} {:>9.2f} {:>6}".format(k+1, row["spec"], row["games"], row["mean_points"], ci, row["mean_rank"], row["wins"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a seeded tournament between agents, without the server.")
+    parser.add_argument("agents", nargs="+", help="agent specs, 'module:function' or 'module:Class.method'")
+    parser.add_argument("--games", type=int, default=10, help="number of games (per lineup)")
+    parser.add_argument("--rounds", type=int, default=10, help="rounds per game")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game, game k uses seed+k")
+    parser.add_argument("--players-per-game", type=int, default=None, help="play a round-robin of all lineups of this size")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of cpus)")
+    parser.add_argument("--path", action="append", default=None, help="extra import path for the agents (default: current dir)")
+    args = parser.parse_args()
+
+    paths = args.path if args.path is not None else [os.getcwd()]
+
+    leadboard = run_tournament(args.agents,
+                               n_games=args.games,
+                               num_rounds=args.rounds,
+                               seed=args.seed,
+                               players_per_game=args.players_per_game,
+                               n_workers=args.workers,
+                               paths=paths)
+    print_leadboard(leadboard)
@@ -0,0 +1,67 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+############################################################################################
+#
+# wire
+#   Encoding of the messages sent between the server and the agents.
+#
+#   "json"     text frames (default). Uses orjson when it is installed, otherwise the
+#              standard json module - the output is plain json either way.
+#   "msgpack"  binary MessagePack frames, picked by the agent in the agent_info
+#              handshake ("format": "msgpack"). Needs the msgpack package on both sides.
+#
+############################################################################################
+
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+FORMATS = (FORMAT_JSON, FORMAT_MSGPACK)
+
+
+def encode_json(message:dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(message, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+
+    return json.dumps(message)
+
+
+def decode_json(data):
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def format_available(wire_format:str) -> bool:
+    if wire_format == FORMAT_JSON:
+        return True
+
+    if wire_format == FORMAT_MSGPACK:
+        return msgpack is not None
+
+    return False
+
+
+def encode(message, wire_format:str=FORMAT_JSON):
+    # str for json (text frame), bytes for msgpack (binary frame)
+    if wire_format == FORMAT_MSGPACK:
+        return msgpack.packb(message)
+
+    return encode_json(message)
+
+
+def decode(data, wire_format:str=FORMAT_JSON):
+    if wire_format == FORMAT_MSGPACK:
+        return msgpack.unpackb(data)
+
+    return decode_json(data)
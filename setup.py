@@ -39,14 +39,19 @@ setup(
     long_description=long_description,
     long_description_content_type='text/markdown',
     zip_safe=False,
-    python_requires=">=3.8",
+    python_requires=">=3.9",
     packages=['dnd_auction_game'],
     install_requires=[
           'py-machineid>=0.4.5',
           'fastapi',
           'uvicorn',
           'websockets',
-          'Jinja2'
+          'Jinja2',
+          'numpy'
       ],
+    extras_require={
+          'orjson': ['orjson'],
+          'msgpack': ['msgpack'],
+      },
 )
 